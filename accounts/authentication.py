@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+
+def user_cache_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user from a short-lived
+    cache (AUTH_USER_CACHE_SECONDS) instead of the database on every request.
+    Entries are dropped when the user is saved or deleted and on logout, so
+    a deactivated user is rejected immediately; otherwise the staleness is
+    bounded by the TTL. Set AUTH_USER_CACHE_SECONDS=0 to always hit the DB.
+    """
+
+    def get_user(self, validated_token):
+        ttl = settings.AUTH_USER_CACHE_SECONDS
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if not ttl or user_id is None:
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            #raises for unknown or inactive users, which are never cached
+            user = super().get_user(validated_token)
+            cache.set(key, user, ttl)
+            return user
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            #same check as the parent, against the cached password hash
+            return self._check_revoked(user, validated_token)
+
+        return user
+
+    def _check_revoked(self, user, validated_token):
+        from rest_framework_simplejwt.exceptions import AuthenticationFailed
+        from rest_framework_simplejwt.utils import get_md5_hash_password
+
+        if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        return user
+
+
+def _invalidate_on_change(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete
+
+    User = get_user_model()
+    post_save.connect(_invalidate_on_change, sender=User, dispatch_uid="auth-user-cache-save")
+    post_delete.connect(_invalidate_on_change, sender=User, dispatch_uid="auth-user-cache-delete")
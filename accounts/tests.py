@@ -1,3 +1,62 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from image_pro.models import Image
+from .authentication import user_cache_key
+from .models import User
 
-# Create your tests here.
+
+@override_settings(AUTH_USER_CACHE_SECONDS=60)
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="poller", password="secret-pass-123")
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.refresh.access_token}")
+        self.image = Image.objects.create(
+            user=self.user,
+            original_image="images/originals/test.png",
+            image_format="png",
+            status="pending",
+        )
+        self.url = f"/api/images/{self.image.id}/"
+
+    def test_cache_hit_makes_no_identity_queries(self):
+        #cold: the user row, then the image
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        #warm: only the image; the ownership check compares ids
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_user_change_invalidates_cache(self):
+        self.client.get(self.url)
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_logout_invalidates_cache(self):
+        self.client.get(self.url)
+
+        response = self.client.post("/accounts/logout/", {"refresh": str(self.refresh)}, format="json")
+
+        self.assertEqual(response.status_code, 205)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_other_users_image_is_forbidden(self):
+        other = User.objects.create_user(username="other", password="secret-pass-123")
+        image = Image.objects.create(
+            user=other,
+            original_image="images/originals/other.png",
+            image_format="png",
+            status="pending",
+        )
+
+        self.assertEqual(self.client.get(f"/api/images/{image.id}/").status_code, 403)
@@ -4,6 +4,7 @@ from .serializers import RegisterSerializer
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import invalidate_cached_user
 
 class RegisterView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
@@ -38,6 +39,8 @@ class LogoutView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        invalidate_cached_user(request.user.pk)
+
         return Response(
             {"message": "Logged out successfully."},
             status=status.HTTP_205_RESET_CONTENT
@@ -0,0 +1,117 @@
+"""
+Benchmark animated WebP/GIF processing on long animations.
+
+Compares the frame-by-frame pipeline (image_pro.processing.encode_image)
+with materializing every transformed frame first, which is what a plain
+Pillow save_all needs. Each run happens in a fresh process so peak RSS is
+comparable.
+
+    python benchmarks/animation_bench.py --frames 600 --size 640x360
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from image_pro.processing import apply_operations, encode_image  # noqa: E402
+
+
+OPERATIONS = [
+    ("resize", {"width": 480, "height": 270}),
+    ("filter", {"type": "sharpen"}),
+    ("compress", {"quality": 75}),
+    ("convert", {"format": "webp"}),
+]
+
+
+def make_source(path, frames, size):
+    def frame(i):
+        img = Image.new("RGB", size, ((i * 7) % 256, (i * 3) % 256, 128))
+        img.paste((255, 255, 255), (i % size[0], 0, i % size[0] + 20, size[1]))
+        return img
+
+    first = frame(0)
+    first.save(
+        path,
+        format="GIF",
+        save_all=True,
+        append_images=(frame(i) for i in range(1, frames)),
+        duration=40,
+        loop=0,
+    )
+
+
+def run_streaming(source, output):
+    img = Image.open(source)
+    with open(output, "wb") as fp:
+        encode_image(img, fp, OPERATIONS, "gif")
+
+
+def run_buffered(source, output):
+    img = Image.open(source)
+    frames, durations = [], []
+    for index in range(img.n_frames):
+        img.seek(index)
+        frames.append(apply_operations(img.convert("RGBA"), OPERATIONS))
+        durations.append(img.info.get("duration", 100))
+
+    frames[0].save(
+        output,
+        format="WEBP",
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=img.info.get("loop", 0),
+        quality=75,
+    )
+
+
+def child(mode, source):
+    with tempfile.NamedTemporaryFile(suffix=".webp") as output:
+        start = time.perf_counter()
+        {"streaming": run_streaming, "buffered": run_buffered}[mode](source, output.name)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(output.name)
+
+    print(json.dumps({
+        "mode": mode,
+        "seconds": round(elapsed, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "output_kb": size // 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--size", default="640x360")
+    parser.add_argument("--child", choices=["streaming", "buffered"])
+    parser.add_argument("--source")
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.source)
+        return
+
+    size = tuple(int(v) for v in args.size.split("x"))
+    with tempfile.NamedTemporaryFile(suffix=".gif") as source:
+        make_source(source.name, args.frames, size)
+        print(f"{args.frames} frames at {args.size}")
+
+        for mode in ("streaming", "buffered"):
+            subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--source", source.name],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
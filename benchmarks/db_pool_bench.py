@@ -0,0 +1,114 @@
+"""
+Database connection count and query latency under load.
+
+Simulates N processes (gunicorn workers / celery children) with T threads
+each, running short queries like process_image_task's status saves, while
+sampling the number of server connections from pg_stat_activity. Run it
+once per DB_POOL_MODE against a Postgres DATABASE_URL:
+
+    DB_POOL_MODE=persistent python benchmarks/db_pool_bench.py
+    DB_POOL_MODE=pool SERVICE_TYPE=worker python benchmarks/db_pool_bench.py --processes 8 --threads 1
+    DB_POOL_MODE=pgbouncer DATABASE_URL=postgres://...@127.0.0.1:6432/db python benchmarks/db_pool_bench.py
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+
+def setup():
+    import django
+    django.setup()
+
+
+def worker(queries, threads, pause, results):
+    setup()
+    from django.db import connection, close_old_connections
+
+    latencies = []
+    lock = threading.Lock()
+
+    def run():
+        for _ in range(queries):
+            close_old_connections()
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+            #the rest of a job is image work, not DB
+            time.sleep(pause)
+        connection.close()
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+    results.extend(latencies)
+
+
+def count_connections():
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()"
+        )
+        return cursor.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=6)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pause", type=float, default=0.02)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+
+    if settings.DATABASES["default"]["ENGINE"] != "django.db.backends.postgresql":
+        raise SystemExit("Point DATABASE_URL at Postgres to measure connection counts.")
+
+    with multiprocessing.Manager() as manager:
+        results = manager.list()
+        procs = [
+            multiprocessing.Process(target=worker, args=(args.queries, args.threads, args.pause, results))
+            for _ in range(args.processes)
+        ]
+        start = time.perf_counter()
+        for p in procs:
+            p.start()
+
+        samples = []
+        while any(p.is_alive() for p in procs):
+            samples.append(count_connections())
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - start
+
+        for p in procs:
+            p.join()
+        latencies = sorted(results)
+
+    print(f"mode={settings.DB_POOL_MODE} role={settings.SERVICE_ROLE} "
+          f"processes={args.processes} threads={args.threads}")
+    print(f"queries: {len(latencies)} in {elapsed:.1f} s")
+    print(f"connections: peak {max(samples)}, mean {statistics.mean(samples):.1f}")
+    print(f"latency ms: p50 {latencies[len(latencies) // 2] * 1000:.2f}, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Load-test harness for the pipelined worker mode on one core.
+
+Runs the same stream of jobs through one worker loop twice, with storage
+replaced by a stand-in that adds per-request latency and a bandwidth cap:
+
+- sequential: fetch, process, upload, one job after another (the default
+  process_image_task path)
+- pipelined: originals prefetched by a background thread (what each pool
+  child's prefetch threads do for reserved tasks) and outputs uploaded through
+  image_pro.pipeline.submit_upload with its bounded buffer
+
+    python benchmarks/pipeline_bench.py --jobs 40 --latency-ms 60 --mbps 200
+"""
+import argparse
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    IMAGE_PIPELINE_IO_THREADS=2,
+    IMAGE_PIPELINE_PENDING_UPLOADS=2,
+    IMAGE_PIPELINE_PREFETCH=2,
+    IMAGE_PIPELINE_MODE=True,
+)
+
+from PIL import Image  # noqa: E402
+
+from image_pro import pipeline  # noqa: E402
+from image_pro.processing import encode_image  # noqa: E402
+
+
+OPERATIONS = [
+    ("resize", {"width": 1600, "height": 1200}),
+    ("filter", {"type": "sharpen"}),
+    ("compress", {"quality": 80}),
+]
+
+
+class SlowStorage:
+    """
+    Stand-in for S3: every request pays latency plus size / bandwidth.
+    """
+
+    def __init__(self, latency, mbps):
+        self.latency = latency
+        self.bytes_per_second = mbps * 1024 * 1024 / 8
+        self.objects = {}
+
+    def _wait(self, size):
+        time.sleep(self.latency + size / self.bytes_per_second)
+
+    def get(self, name):
+        data = self.objects[name]
+        self._wait(len(data))
+        return data
+
+    def put(self, name, data):
+        self._wait(len(data))
+        self.objects[name] = data
+
+
+def make_originals(storage, jobs, size):
+    for i in range(jobs):
+        img = Image.new("RGB", size, ((i * 40) % 256, 90, 160))
+        img.paste((255, 255, 255), (i * 10 % size[0], 0, i * 10 % size[0] + 200, size[1]))
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=90)
+        storage.objects[f"original_{i}.jpg"] = buffer.getvalue()
+
+
+def process(data):
+    output = io.BytesIO()
+    encode_image(Image.open(io.BytesIO(data)), output, OPERATIONS, "jpg")
+    return output.getvalue()
+
+
+def run_sequential(storage, jobs):
+    for i in range(jobs):
+        data = storage.get(f"original_{i}.jpg")
+        storage.put(f"processed_{i}.jpg", process(data))
+
+
+def run_pipelined(storage, jobs):
+    #bounded like the reserved-task window of a worker
+    fetched = queue.Queue(maxsize=settings.IMAGE_PIPELINE_PREFETCH)
+
+    def prefetcher():
+        for i in range(jobs):
+            fetched.put((i, storage.get(f"original_{i}.jpg")))
+
+    threading.Thread(target=prefetcher, daemon=True).start()
+
+    for _ in range(jobs):
+        i, data = fetched.get()
+        output = process(data)
+        pipeline.submit_upload(lambda i=i, output=output: storage.put(f"processed_{i}.jpg", output))
+
+    pipeline.drain_uploads()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=30)
+    parser.add_argument("--size", default="2400x1800")
+    parser.add_argument("--latency-ms", type=float, default=60)
+    parser.add_argument("--mbps", type=float, default=200)
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.split("x"))
+    print(f"{args.jobs} jobs at {args.size}, storage latency {args.latency_ms} ms, {args.mbps} Mbit/s")
+
+    for mode, runner in (("sequential", run_sequential), ("pipelined", run_pipelined)):
+        storage = SlowStorage(args.latency_ms / 1000, args.mbps)
+        make_originals(storage, args.jobs, size)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        runner(storage, args.jobs)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        assert len([n for n in storage.objects if n.startswith("processed_")]) == args.jobs
+        print(f"{mode:<11} {args.jobs / wall:6.2f} jobs/s  wall {wall:6.2f} s  cpu busy {cpu / wall:5.0%}")
+
+
+if __name__ == "__main__":
+    main()
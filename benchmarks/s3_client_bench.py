@@ -0,0 +1,95 @@
+"""
+S3 throughput with one client per thread (django-storages' default) against
+MediaStorage's single pooled client per process.
+
+Each round runs save / open+read / exists on fresh threads, as short-lived
+I/O threads do, so per-thread client setup and TLS handshakes show up in the
+numbers. Needs S3 or an S3-compatible stand-in, e.g. a local MinIO:
+
+    docker run -p 9000:9000 minio/minio server /data
+    DJANGO_SETTINGS_MODULE=config.settings.prod AWS_S3_ENDPOINT_URL=http://127.0.0.1:9000 \\
+        AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin AWS_STORAGE_BUCKET_NAME=bench \\
+        python benchmarks/s3_client_bench.py --rounds 20 --threads 16
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.prod")
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(label, storage, args, payload):
+    from django.core.files.base import ContentFile
+
+    sessions = []
+    create_session = storage._create_session
+
+    def counted_session():
+        sessions.append(1)
+        return create_session()
+
+    storage._create_session = counted_session
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+
+    def job(i):
+        name = f"{prefix}/{i}.bin"
+        start = time.perf_counter()
+        storage.save(name, ContentFile(payload))
+        with storage.open(name) as fh:
+            fh.read()
+        storage.exists(name)
+        return time.perf_counter() - start
+
+    latencies = []
+    names = []
+    start = time.perf_counter()
+    for r in range(args.rounds):
+        ids = range(r * args.threads, (r + 1) * args.threads)
+        with ThreadPoolExecutor(args.threads) as pool:
+            latencies.extend(pool.map(job, ids))
+        names.extend(f"{prefix}/{i}.bin" for i in ids)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{label:<22} {len(latencies) / elapsed:8.1f} jobs/s  "
+          f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms  "
+          f"clients created {len(sessions)}")
+
+    for name in names:
+        storage.delete(name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--size-kb", type=int, default=200)
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from storages.backends.s3boto3 import S3Boto3Storage
+    from config.storages import MediaStorage, storage_metrics
+
+    payload = os.urandom(args.size_kb * 1024)
+
+    #library defaults: a client per thread, 10 connections, legacy retries
+    run("per-thread clients", S3Boto3Storage(location="media", file_overwrite=True, client_config=None), args, payload)
+    run("pooled client", MediaStorage(), args, payload)
+
+    print("\npooled client, per operation:")
+    for operation, stats in sorted(storage_metrics().items()):
+        print(f"  {operation:<16} {stats}")
+
+
+if __name__ == "__main__":
+    main()
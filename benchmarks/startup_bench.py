@@ -0,0 +1,98 @@
+"""
+Cold start profile of the web process.
+
+1. Import-time profile (python -X importtime) of Django setup plus the URL
+   conf, aggregated per top-level package.
+2. Time from launching gunicorn to the first served request on /healthz/.
+
+    python benchmarks/startup_bench.py
+    python benchmarks/startup_bench.py --no-preload --top 15
+    python benchmarks/startup_bench.py --settings config.settings.prod
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP_CODE = (
+    "import django;"
+    "django.setup();"
+    "import config.urls, image_pro.views"
+)
+
+
+def import_profile(top, settings_module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SETUP_CODE],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        env=dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module),
+    )
+
+    #"import time: self [us] | cumulative | imported package"
+    per_package = defaultdict(int)
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        package = name.strip().split(".")[0]
+        per_package[package] += int(self_us)
+        total += int(self_us)
+
+    print(f"Total import time: {total / 1000:.0f} ms")
+    for package, us in sorted(per_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<30} {us / 1000:8.1f} ms")
+
+
+def first_request(port, preload, settings_module):
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GUNICORN_PRELOAD="true" if preload else "false",
+        DJANGO_SETTINGS_MODULE=settings_module,
+    )
+
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "config.wsgi:application", "-c", "config/gunicorn.conf.py",
+         "--bind", f"127.0.0.1:{port}"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz/", timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                if server.poll() is not None:
+                    raise SystemExit("gunicorn exited before serving a request")
+                time.sleep(0.01)
+
+        print(f"Time to first served request (preload={preload}): {time.perf_counter() - start:.2f} s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-preload", action="store_true")
+    parser.add_argument("--settings", default=os.getenv("DJANGO_SETTINGS_MODULE", "config.settings.dev"))
+    args = parser.parse_args()
+
+    print(f"Settings: {args.settings}")
+    import_profile(args.top, args.settings)
+    first_request(args.port, not args.no_preload, args.settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Save latency of the old flat key layout (with the existence check that
+file_overwrite = False adds) against hash-sharded UUID keys without it.
+
+Needs S3 or an S3-compatible stand-in, e.g. a local MinIO:
+
+    docker run -p 9000:9000 minio/minio server /data
+    DJANGO_SETTINGS_MODULE=config.settings.prod AWS_S3_ENDPOINT_URL=http://127.0.0.1:9000 \\
+        AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin AWS_STORAGE_BUCKET_NAME=bench \\
+        python benchmarks/storage_save_bench.py --saves 200 --threads 8
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.prod")
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(label, storage, names, payload, threads):
+    from django.core.files.base import ContentFile
+
+    def save(name):
+        start = time.perf_counter()
+        storage.save(name, ContentFile(payload))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = sorted(pool.map(save, names))
+    elapsed = time.perf_counter() - start
+
+    print(f"{label:<28} {len(names) / elapsed:8.1f} saves/s  "
+          f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms")
+
+    for name in names:
+        storage.delete(name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--saves", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--size-kb", type=int, default=200)
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from config.storages import MediaStorage
+    from image_pro.storage_keys import image_key
+
+    payload = os.urandom(args.size_kb * 1024)
+    run_id = uuid.uuid4().hex[:8]
+
+    #old layout: one flat prefix, name checked (and suffixed if taken) before each save
+    flat = [f"bench-{run_id}/images/processed/processed_{uuid.uuid4()}.jpg" for _ in range(args.saves)]
+    run("flat, existence check", MediaStorage(file_overwrite=False), flat, payload, args.threads)
+
+    sharded = [f"bench-{run_id}/{image_key('processed', uuid.uuid4(), 'x.jpg')}" for _ in range(args.saves)]
+    run("sharded, no existence check", MediaStorage(file_overwrite=True), sharded, payload, args.threads)
+
+
+if __name__ == "__main__":
+    main()
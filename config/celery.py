@@ -16,4 +16,20 @@ app.conf.beat_schedule = {
         'task': 'image_pro.tasks.delete_expired_images',
         'schedule': 300.0, 
     },
+    'delete-expired-uploads-every-hour': {
+        'task': 'image_pro.tasks.delete_expired_upload_sessions',
+        'schedule': 3600.0,
+    },
+    'retry-webhooks-every-30-sec': {
+        'task': 'image_pro.tasks.deliver_webhooks',
+        'schedule': 30.0,
+    },
+    'dispatch-fair-queue-every-5-sec': {
+        'task': 'image_pro.tasks.dispatch_fair_queue',
+        'schedule': 5.0,
+    },
+    'requeue-stuck-images-every-min': {
+        'task': 'image_pro.tasks.requeue_stuck_images',
+        'schedule': 60.0,
+    },
 }
\ No newline at end of file
@@ -0,0 +1,27 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", "3"))
+threads = int(os.getenv("GUNICORN_THREADS", "2"))
+
+#import the app once in the master and fork it, so new workers start warm
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+
+def pre_fork(server, worker):
+    """
+    Runs in the master: drop any DB connection opened while preloading so
+    forked workers never share a socket. Redis, the webhook session and the
+    S3 client (config/storages.py) check the pid themselves.
+    """
+    if not preload_app:
+        return
+
+    from django.db import connections
+    connections.close_all()
+
+    #DB_POOL_MODE=pool: close_all() only returns connections to the psycopg
+    #pool, whose sockets and worker threads would be inherited by every worker
+    for conn in connections.all():
+        if conn.alias in getattr(conn, "_connection_pools", ()):
+            conn.close_pool()
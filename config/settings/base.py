@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 import dj_database_url
@@ -70,9 +71,50 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASE_URL = os.getenv('DATABASE_URL', f"sqlite:///{BASE_DIR / 'db.sqlite3'}")
 
 DATABASES = {
-    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600)
+    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600, conn_health_checks=True)
 }
 
+# persistent: one long-lived connection per thread/process (default)
+# pool: psycopg 3 connection pool per process, sized per role
+# pgbouncer: short connections through a local transaction-pooling proxy
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "persistent")
+SERVICE_ROLE = "worker" if os.getenv("SERVICE_TYPE") == "worker" else "web"
+
+if DATABASES["default"]["ENGINE"] == "django.db.backends.postgresql":
+    if DB_POOL_MODE == "pool":
+        from psycopg_pool import ConnectionPool
+
+        #celery children only do a few short saves per job, so they keep
+        #no idle connections; in pipelined mode (IMAGE_PIPELINE_MODE) each
+        #upload thread saves too and needs its own
+        worker_connections = 1
+        if os.getenv("IMAGE_PIPELINE_MODE", "false").lower() == "true":
+            worker_connections += int(os.getenv("IMAGE_PIPELINE_IO_THREADS", "2"))
+        #gunicorn threads share a small pool, plus one connection per inline
+        #processing thread (IMAGE_INLINE_MAX_RUNNING)
+        web_connections = int(os.getenv("GUNICORN_THREADS", "2"))
+        if float(os.getenv("IMAGE_INLINE_MAX_COST", "1")) > 0:
+            web_connections += int(os.getenv("IMAGE_INLINE_MAX_RUNNING", os.getenv("GUNICORN_THREADS", "2")))
+        pool_defaults = {
+            "web": ("1", str(web_connections), "600"),
+            "worker": ("0", str(worker_connections), "30"),
+        }[SERVICE_ROLE]
+        role = SERVICE_ROLE.upper()
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"].setdefault("OPTIONS", {})["pool"] = {
+            "min_size": int(os.getenv(f"DB_POOL_{role}_MIN_SIZE", pool_defaults[0])),
+            "max_size": int(os.getenv(f"DB_POOL_{role}_MAX_SIZE", pool_defaults[1])),
+            "max_idle": int(os.getenv(f"DB_POOL_{role}_MAX_IDLE", pool_defaults[2])),
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+            "check": ConnectionPool.check_connection,
+        }
+
+    elif DB_POOL_MODE == "pgbouncer":
+        DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", "0"))
+        #transaction pooling can't keep cursors or prepared statements across transactions
+        DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+        DATABASES["default"].setdefault("OPTIONS", {})["prepare_threshold"] = None
+
 
 
 AUTH_USER_MODEL = "accounts.User"
@@ -112,12 +154,15 @@ REST_FRAMEWORK = {
     ],
 
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication"
+        "accounts.authentication.CachedJWTAuthentication"
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
 
+#seconds a token's user is served from the cache; 0 loads it on every request
+AUTH_USER_CACHE_SECONDS = int(os.getenv("AUTH_USER_CACHE_SECONDS", "60"))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=10),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
@@ -130,6 +175,129 @@ CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', "redis://localhost:6379/0")
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
+#unacked (acks_late) tasks are redelivered after this long if the worker vanished
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "900")),
+}
+#previews run on their own lane so they never wait behind full jobs
+CELERY_TASK_ROUTES = {
+    "image_pro.tasks.generate_preview_task": {"queue": "previews"},
+}
+#one task at a time per pool process, so expensive jobs are not hoarded;
+#pipelined workers reserve one more each so its original can be prefetched
+CELERY_WORKER_PREFETCH_MULTIPLIER = 2 if os.getenv("IMAGE_PIPELINE_MODE", "false").lower() == "true" else 1
+#used with --autoscale=max,min
+CELERY_WORKER_AUTOSCALER = "image_pro.autoscale:CostAwareAutoscaler"
+IMAGE_WORKER_MEMORY_BUDGET_BYTES = int(os.getenv("IMAGE_WORKER_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024
+#assumed size of jobs enqueued without header data
+IMAGE_DEFAULT_JOB_PIXELS = int(os.getenv("IMAGE_DEFAULT_JOB_PIXELS", str(12_000_000)))
+
+# Per-image processing lease; must outlast the slowest job
+IMAGE_TASK_LEASE_SECONDS = int(os.getenv("IMAGE_TASK_LEASE_SECONDS", "600"))
+# Jobs still in processing after this long are re-enqueued by the reaper
+IMAGE_TASK_STUCK_AFTER_SECONDS = int(os.getenv("IMAGE_TASK_STUCK_AFTER_SECONDS", "900"))
+# Runs an image gets (worker crashes, reaper re-enqueues) before it is marked failed
+IMAGE_TASK_MAX_ATTEMPTS = int(os.getenv("IMAGE_TASK_MAX_ATTEMPTS", "3"))
+
+
+# Worker-local cache of originals (see image_pro/cache.py)
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "imagepro-originals"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024
+IMAGE_DECODED_CACHE_SIZE = int(os.getenv("IMAGE_DECODED_CACHE_SIZE", "0"))
+#0 disables routing; otherwise workers consume images.shard0..N-1
+IMAGE_CACHE_ROUTING_SHARDS = int(os.getenv("IMAGE_CACHE_ROUTING_SHARDS", "0"))
+
+# Resumable uploads (/api/uploads/)
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv("UPLOAD_CHUNK_MAX_MB", "5")) * 1024 * 1024
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+# Pipelined worker mode (image_pro/pipeline.py): prefetch originals of reserved
+# jobs and upload outputs in the background while the next job is processed
+IMAGE_PIPELINE_MODE = os.getenv("IMAGE_PIPELINE_MODE", "false").lower() == "true"
+IMAGE_PIPELINE_PREFETCH = int(os.getenv("IMAGE_PIPELINE_PREFETCH", "4"))
+IMAGE_PIPELINE_IO_THREADS = int(os.getenv("IMAGE_PIPELINE_IO_THREADS", "2"))
+IMAGE_PIPELINE_PENDING_UPLOADS = int(os.getenv("IMAGE_PIPELINE_PENDING_UPLOADS", "2"))
+
+# Max ids per /api/images/status/ request
+IMAGE_BULK_STATUS_MAX_IDS = int(os.getenv("IMAGE_BULK_STATUS_MAX_IDS", "500"))
+
+# Inline processing of small uploads (POST /api/images/?sync=true); 0 cost disables
+IMAGE_INLINE_MAX_COST = float(os.getenv("IMAGE_INLINE_MAX_COST", "1"))
+IMAGE_INLINE_MAX_BYTES = int(os.getenv("IMAGE_INLINE_MAX_KB", "1024")) * 1024
+IMAGE_INLINE_BUDGET_MS = int(os.getenv("IMAGE_INLINE_BUDGET_MS", "1500"))
+#per web process; uploads past it are queued. Each run holds a DB connection
+IMAGE_INLINE_MAX_RUNNING = int(os.getenv("IMAGE_INLINE_MAX_RUNNING", os.getenv("GUNICORN_THREADS", "2")))
+
+# Upload-time previews
+IMAGE_PREVIEW_SIZE = int(os.getenv("IMAGE_PREVIEW_SIZE", "256"))
+IMAGE_PLACEHOLDER_SIZE = 16
+
+# Encoded outputs above this size are spooled to disk instead of memory
+IMAGE_OUTPUT_SPOOL_MAX_BYTES = int(os.getenv("IMAGE_OUTPUT_SPOOL_MAX_MB", "8")) * 1024 * 1024
+
+# Per-tenant fair scheduling of processing jobs (image_pro/scheduling.py), Redis only.
+# Weights per tier: "anon", "user", or a Django group name, e.g. "anon:1,user:2,pro:4"
+IMAGE_FAIR_SCHEDULING = os.getenv("IMAGE_FAIR_SCHEDULING", "true").lower() == "true"
+IMAGE_FAIR_WEIGHTS = {
+    tier.strip(): float(weight)
+    for tier, weight in (
+        item.split(":") for item in os.getenv("IMAGE_FAIR_WEIGHTS", "anon:1,user:2").split(",") if item.strip()
+    )
+}
+IMAGE_FAIR_QUANTUM = float(os.getenv("IMAGE_FAIR_QUANTUM", "10"))
+#jobs kept in the broker; at least the total worker concurrency
+IMAGE_FAIR_DISPATCH_DEPTH = int(os.getenv("IMAGE_FAIR_DISPATCH_DEPTH", "16"))
+
+# Upload admission control (image_pro/admission.py): refuse uploads with 503 while
+# the processing backlog is over max_backlog jobs or max_drain_seconds to clear
+IMAGE_ADMISSION_CONTROL = os.getenv("IMAGE_ADMISSION_CONTROL", "true").lower() == "true"
+IMAGE_ADMISSION_LIMITS = {
+    "user": {
+        "max_backlog": int(os.getenv("IMAGE_ADMISSION_USER_MAX_BACKLOG", "5000")),
+        "max_drain_seconds": int(os.getenv("IMAGE_ADMISSION_USER_MAX_DRAIN_SECONDS", "600")),
+    },
+    "anon": {
+        "max_backlog": int(os.getenv("IMAGE_ADMISSION_ANON_MAX_BACKLOG", "1000")),
+        "max_drain_seconds": int(os.getenv("IMAGE_ADMISSION_ANON_MAX_DRAIN_SECONDS", "120")),
+    },
+}
+IMAGE_ADMISSION_RATE_WINDOW_SECONDS = 300
+IMAGE_ADMISSION_MIN_DRAIN_RATE = float(os.getenv("IMAGE_ADMISSION_MIN_DRAIN_RATE", "0.5"))
+IMAGE_ADMISSION_STATE_SECONDS = 5
+IMAGE_ADMISSION_MAX_RETRY_AFTER = 600
+
+# Upload compute budgets, in megapixel-weighted cost units (image_pro/utils.py)
+IMAGE_COST_BUDGETS = {
+    "user": {
+        "capacity": int(os.getenv("IMAGE_COST_USER_CAPACITY", "400")),
+        "refill_per_min": int(os.getenv("IMAGE_COST_USER_REFILL_PER_MIN", "200")),
+    },
+    "anon": {
+        "capacity": int(os.getenv("IMAGE_COST_ANON_CAPACITY", "40")),
+        "refill_per_min": int(os.getenv("IMAGE_COST_ANON_REFILL_PER_MIN", "20")),
+    },
+}
+
+# Completion webhooks (image_pro/webhooks.py)
+WEBHOOK_DEFAULT_SECRET = os.getenv("WEBHOOK_DEFAULT_SECRET", "")
+WEBHOOK_ALLOW_HTTP = os.getenv("WEBHOOK_ALLOW_HTTP", "false").lower() == "true"
+#deliver to loopback/private/link-local addresses; only for local receivers
+WEBHOOK_ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "false").lower() == "true"
+WEBHOOK_TIMEOUT = int(os.getenv("WEBHOOK_TIMEOUT", "5"))
+WEBHOOK_POOL_SIZE = int(os.getenv("WEBHOOK_POOL_SIZE", "10"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_BATCH_WINDOW_SECONDS = int(os.getenv("WEBHOOK_BATCH_WINDOW_SECONDS", "2"))
+WEBHOOK_CLAIM_LIMIT = 500
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS = 10
+WEBHOOK_RETRY_MAX_SECONDS = 3600
+
+# Tracing (image_pro/tracing.py): none, file, otlp or a dotted SpanExporter path
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", f"imagepro-{SERVICE_ROLE}")
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", os.path.join(tempfile.gettempdir(), "imagepro-traces.jsonl"))
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_EXPORT_TIMEOUT = int(os.getenv("TRACE_EXPORT_TIMEOUT", "2"))
 
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -5,6 +5,9 @@ load_dotenv()
 DEBUG = True
 ALLOWED_HOSTS = ['127.0.0.1','localhost']
 CORS_ALLOW_ALL_ORIGINS = True
+#local webhook receivers
+WEBHOOK_ALLOW_HTTP = True
+WEBHOOK_ALLOW_PRIVATE = True
 
 
 STATIC_URL = '/static/'
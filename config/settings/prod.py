@@ -35,6 +35,8 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
 AWS_S3_REGION_NAME = os.getenv("AWS_S3_REGION_NAME")
+#e.g. a local MinIO for benchmarks
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL") or None
 
 AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com"
 
@@ -46,6 +48,27 @@ AWS_S3_FILE_OVERWRITE = False
 AWS_S3_OBJECT_PARAMETERS = {
     "CacheControl": "max-age=86400",
 }
+#plain dicts: boto3 is only imported once storage is first used, and
+#config/storages.py turns these into botocore/boto3 config objects
+#outputs above the threshold are uploaded as parallel multipart parts
+AWS_S3_TRANSFER_OPTIONS = {
+    "multipart_threshold": int(os.getenv("AWS_S3_MULTIPART_THRESHOLD_MB", "8")) * 1024 * 1024,
+    "multipart_chunksize": int(os.getenv("AWS_S3_MULTIPART_CHUNKSIZE_MB", "8")) * 1024 * 1024,
+    "max_concurrency": int(os.getenv("AWS_S3_MAX_CONCURRENCY", "4")),
+}
+#one client per process is shared by all its threads (config/storages.py),
+#so the pool has to cover upload threads x AWS_S3_MAX_CONCURRENCY
+AWS_S3_CLIENT_OPTIONS = {
+    "max_pool_connections": int(os.getenv("AWS_S3_MAX_POOL_CONNECTIONS", "32")),
+    "retries": {
+        "mode": "adaptive",
+        "max_attempts": int(os.getenv("AWS_S3_MAX_ATTEMPTS", "5")),
+    },
+    "connect_timeout": float(os.getenv("AWS_S3_CONNECT_TIMEOUT", "5")),
+    "read_timeout": float(os.getenv("AWS_S3_READ_TIMEOUT", "30")),
+    "tcp_keepalive": True,
+    "signature_version": AWS_S3_SIGNATURE_VERSION,
+}
 
 AWS_LOCATION_STATIC = "static"
 AWS_LOCATION_MEDIA = "media"
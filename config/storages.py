@@ -1,12 +1,187 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from django.conf import settings
 from storages.backends.s3boto3 import S3Boto3Storage
 
+
+_metrics_lock = threading.Lock()
+_metrics = defaultdict(lambda: {"calls": 0, "errors": 0, "seconds": 0.0, "recent": deque(maxlen=1000)})
+
+
+def _before_call(model, context, **kwargs):
+    context["storage_call"] = (model.name, time.perf_counter())
+
+
+def _record(context, error):
+    call = context.get("storage_call")
+    if call is None:
+        return
+
+    name, started = call
+    elapsed = time.perf_counter() - started
+    with _metrics_lock:
+        entry = _metrics[name]
+        entry["calls"] += 1
+        entry["errors"] += error
+        entry["seconds"] += elapsed
+        entry["recent"].append(elapsed)
+
+
+def _after_call(context, **kwargs):
+    _record(context, 0)
+
+
+def _after_call_error(context, **kwargs):
+    #botocore does not pass the operation model here
+    _record(context, 1)
+
+
+def storage_metrics():
+    """
+    Per S3 operation in this process: calls, errors (after retries) and
+    latency in ms (mean overall, p50/p95 of the last 1000 calls).
+    """
+    with _metrics_lock:
+        snapshot = {name: dict(entry, recent=sorted(entry["recent"])) for name, entry in _metrics.items()}
+
+    stats = {}
+    for name, entry in snapshot.items():
+        recent = entry["recent"]
+        stats[name] = {
+            "calls": entry["calls"],
+            "errors": entry["errors"],
+            "mean_ms": round(entry["seconds"] / entry["calls"] * 1000, 1) if entry["calls"] else None,
+            "p50_ms": round(recent[len(recent) // 2] * 1000, 1) if recent else None,
+            "p95_ms": round(recent[min(int(len(recent) * 0.95), len(recent) - 1)] * 1000, 1) if recent else None,
+        }
+    return stats
+
+
+_tuned = None
+
+
+def tuned_configs():
+    """
+    (client config, transfer config) from AWS_S3_CLIENT_OPTIONS and
+    AWS_S3_TRANSFER_OPTIONS, built once so every storage instance maps to
+    the same shared client. None where a setting is absent.
+    """
+    global _tuned
+
+    if _tuned is None:
+        client_options = getattr(settings, "AWS_S3_CLIENT_OPTIONS", None)
+        transfer_options = getattr(settings, "AWS_S3_TRANSFER_OPTIONS", None)
+        _tuned = (
+            Config(**client_options) if client_options else None,
+            TransferConfig(**transfer_options) if transfer_options else None,
+        )
+    return _tuned
+
+
+_clients_lock = threading.Lock()
+_clients = {}
+_clients_pid = None
+
+
+def shared_client(storage):
+    """
+    (client, resource class) for a storage's connection settings, built once
+    per process. Low-level clients are thread-safe and hold the connection
+    pool; resources are not, so each thread wraps the client in its own.
+    After a fork the child builds a new client rather than use the parent's
+    sockets.
+    """
+    global _clients_pid
+
+    key = (
+        storage.access_key,
+        storage.session_profile,
+        storage.region_name,
+        storage.endpoint_url,
+        storage.use_ssl,
+        storage.verify,
+        storage.client_config,
+    )
+
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+
+        if key not in _clients:
+            options = {
+                "region_name": storage.region_name,
+                "use_ssl": storage.use_ssl,
+                "endpoint_url": storage.endpoint_url,
+                "config": storage.client_config,
+                "verify": storage.verify,
+            }
+            session = storage._create_session()
+            client = session.client("s3", **options)
+            client.meta.events.register("before-call.s3", _before_call)
+            client.meta.events.register("after-call.s3", _after_call)
+            client.meta.events.register("after-call-error.s3", _after_call_error)
+            #only its class is kept; instances are bound to the shared client
+            resource_class = type(session.resource("s3", **options))
+            _clients[key] = (client, resource_class)
+
+        return _clients[key]
+
+
+class PooledS3Storage(S3Boto3Storage):
+    """
+    All threads of a process share one S3 client, and with it one connection
+    pool, instead of building a client per thread. Pool size, retries and
+    keep-alive come from AWS_S3_CLIENT_OPTIONS, multipart settings from
+    AWS_S3_TRANSFER_OPTIONS; both are plain dicts so that settings never
+    import boto3. Every API call is timed for storage_metrics().
+    """
+
+    def __init__(self, **options):
+        client_config, transfer_config = tuned_configs()
+        if client_config:
+            options.setdefault("client_config", client_config)
+        if transfer_config:
+            options.setdefault("transfer_config", transfer_config)
+
+        super().__init__(**options)
+
+    def _thread_state(self):
+        local = self._connections
+        #thread-locals of the forking thread survive a fork
+        if getattr(local, "pid", None) != os.getpid():
+            client, resource_class = shared_client(self)
+            local.connection = resource_class(client=client)
+            local.bucket = None
+            local.pid = os.getpid()
+        return local
+
+    @property
+    def connection(self):
+        return self._thread_state().connection
+
+    @property
+    def bucket(self):
+        local = self._thread_state()
+        if local.bucket is None:
+            local.bucket = local.connection.Bucket(self.bucket_name)
+        return local.bucket
+
+
 class StaticStorage(S3Boto3Storage):
     location = "static"
     default_acl=None
     querystring_auth = False
 
-class MediaStorage(S3Boto3Storage):
+class MediaStorage(PooledS3Storage):
     location = "media"
     default_acl=None
-    file_overwrite = False
-    querystring_auth = True  
\ No newline at end of file
+    #media keys are unique per image (image_pro/storage_keys.py), so skip
+    #the existence check round trip on every save
+    file_overwrite = True
+    querystring_auth = True
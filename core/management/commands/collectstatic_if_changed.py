@@ -0,0 +1,39 @@
+import hashlib
+from django.contrib.staticfiles.finders import get_finders
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+FINGERPRINT_KEY = "collectstatic:fingerprint"
+
+
+class Command(BaseCommand):
+    help = "Run collectstatic only when the static sources changed since the last run."
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        files = []
+
+        for finder in get_finders():
+            for path, storage in finder.list([]):
+                files.append((path, storage))
+
+        for path, storage in sorted(files, key=lambda f: f[0]):
+            digest.update(path.encode())
+            with storage.open(path) as fh:
+                for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                    digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def handle(self, *args, **options):
+        fingerprint = self.fingerprint()
+
+        #kept in the shared cache so every new container sees the last run
+        if cache.get(FINGERPRINT_KEY) == fingerprint:
+            self.stdout.write("Static files unchanged, skipping collectstatic.")
+            return
+
+        call_command("collectstatic", interactive=False, verbosity=options["verbosity"])
+        cache.set(FINGERPRINT_KEY, fingerprint, timeout=None)
@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import home, api_docs
+from .views import home, api_docs, healthz
 
 urlpatterns = [
     path("", home, name="home"),
     path("api/documentation/", api_docs, name="api-docs"),
+    path("healthz/", healthz, name="healthz"),
 ]
\ No newline at end of file
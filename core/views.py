@@ -1,7 +1,11 @@
+from django.http import HttpResponse
 from django.shortcuts import render
 
 def home(request):
     return render(request, "index.html")
 
 def api_docs(request):
-    return render(request, "docs/api_docs.html")
\ No newline at end of file
+    return render(request, "docs/api_docs.html")
+
+def healthz(request):
+    return HttpResponse("ok", content_type="text/plain")
@@ -2,22 +2,28 @@
 set -e
 
 if [ "$SERVICE_TYPE" = "web" ]; then
-    echo "Running migrations..."
-    python manage.py migrate --noinput
+    #both steps are skipped when there is nothing to do
+    if ! python manage.py migrate --check > /dev/null 2>&1; then
+        echo "Running migrations..."
+        python manage.py migrate --noinput
+    fi
 
     echo "Collecting static files..."
-    python manage.py collectstatic --noinput
+    python manage.py collectstatic_if_changed
 
     echo "Starting Gunicorn..."
-    exec gunicorn config.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 3 --threads 2
+    exec gunicorn config.wsgi:application -c config/gunicorn.conf.py
 
 elif [ "$SERVICE_TYPE" = "worker" ]; then
     if [ "$CELERY_ROLE" = "beat" ]; then
         echo "Starting Celery Beat..."
         exec celery -A config beat -l info
+    elif [ "$CELERY_ROLE" = "previews" ]; then
+        echo "Starting Celery Preview Worker..."
+        exec celery -A config worker -l info --concurrency=${CELERY_PREVIEW_CONCURRENCY:-2} -Q previews -n previews@%h
     else
         echo "Starting Celery Worker..."
-        exec celery -A config worker -l info --concurrency=4
+        exec celery -A config worker -l info --autoscale=${CELERY_MAX_CONCURRENCY:-8},${CELERY_MIN_CONCURRENCY:-1} -Q ${CELERY_QUEUES:-celery}
     fi
 
 fi
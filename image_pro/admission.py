@@ -0,0 +1,97 @@
+"""
+Admission control for uploads. When the processing backlog (broker queues
+plus jobs held by fair scheduling) would take longer to drain than a
+scope's limit, new uploads are refused with 503 and a Retry-After of the
+time until the backlog is back under that limit. The check runs before the
+upload is validated or stored, and again when a resumable upload is
+finalized.
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from .models import Image
+from . import scheduling
+
+
+STATE_KEY = "admission:state"
+
+
+class UploadsShed(APIException):
+    status_code = 503
+    default_detail = "Processing is backed up, try again later."
+    default_code = "uploads_shed"
+
+    def __init__(self, wait):
+        super().__init__()
+        #DRF's exception handler turns this into a Retry-After header
+        self.wait = wait
+
+
+def backlog_state():
+    """
+    Backlog size and drain rate, shared by all web processes for a few
+    seconds so the broker and DB are not asked on every upload.
+    """
+    state = cache.get(STATE_KEY)
+    if state is not None:
+        return state
+
+    backlog = scheduling.held_jobs() + sum(
+        scheduling.broker_queue_depth(queue) for queue in scheduling.process_queues()
+    )
+
+    window = settings.IMAGE_ADMISSION_RATE_WINDOW_SECONDS
+    completed = Image.objects.filter(
+        processing_completed_at__gte=timezone.now() - timedelta(seconds=window)
+    ).count()
+    #floor, so an idle or just-started fleet is not treated as stalled
+    rate = max(completed / window, settings.IMAGE_ADMISSION_MIN_DRAIN_RATE)
+
+    state = {"backlog": backlog, "drain_rate": rate, "drain_seconds": backlog / rate}
+    cache.set(STATE_KEY, state, settings.IMAGE_ADMISSION_STATE_SECONDS)
+    return state
+
+
+def _count(name):
+    key = f"admission:{name}"
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        #evicted between add and incr
+        cache.set(key, 1, None)
+
+
+def admission_counts():
+    names = [f"{outcome}:{scope}" for outcome in ("admitted", "shed") for scope in ("anon", "user")]
+    values = cache.get_many([f"admission:{name}" for name in names])
+    return {name: values.get(f"admission:{name}", 0) for name in names}
+
+
+def check_admission(request):
+    """
+    Raise UploadsShed when the backlog is over the limits for the request's
+    scope ("anon" or "user" in IMAGE_ADMISSION_LIMITS).
+    """
+    if not settings.IMAGE_ADMISSION_CONTROL:
+        return
+
+    scope = "user" if request.user.is_authenticated else "anon"
+    limits = settings.IMAGE_ADMISSION_LIMITS[scope]
+    state = backlog_state()
+
+    #the backlog this scope accepts at the current drain rate
+    allowed = min(limits["max_backlog"], limits["max_drain_seconds"] * state["drain_rate"])
+
+    if state["backlog"] <= allowed:
+        _count(f"admitted:{scope}")
+        return
+
+    _count(f"shed:{scope}")
+    wait = math.ceil((state["backlog"] - allowed) / state["drain_rate"])
+    raise UploadsShed(wait=min(max(wait, 1), settings.IMAGE_ADMISSION_MAX_RETRY_AFTER))
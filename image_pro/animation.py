@@ -0,0 +1,110 @@
+from itertools import chain
+
+
+ANIMATED_FORMATS = ("WEBP", "GIF")
+
+DEFAULT_FRAME_DURATION = 100
+
+
+def is_animated(img):
+    return getattr(img, "is_animated", False)
+
+
+def iter_frames(img, transform):
+    """
+    Decode, transform and yield one frame at a time with its duration in ms.
+    Only the current source frame and its transformed copy are held.
+    """
+    for index in range(img.n_frames):
+        img.seek(index)
+        #WebP only sets the frame's duration in info once it is decoded
+        img.load()
+        duration = img.info.get("duration", DEFAULT_FRAME_DURATION)
+
+        frame = transform(img.convert("RGBA"))
+        if frame.mode not in ("RGB", "RGBA"):
+            frame = frame.convert("RGBA")
+        frame.info["duration"] = duration
+
+        yield frame, duration
+
+
+def _webp_encoder(size, loop):
+    """
+    libwebp's animation encoder from Pillow's private _webp module, or None
+    when this Pillow build has no WebP support or a different signature.
+    """
+    try:
+        from PIL import _webp
+
+        return _webp.WebPAnimEncoder(
+            size,
+            0,  #background, transparent
+            loop,
+            False,  #minimize_size
+            3,  #kmin, same defaults as Pillow for lossy output
+            5,  #kmax
+            False,  #allow_mixed
+            False,  #verbose
+        )
+    except (ImportError, AttributeError, TypeError):
+        return None
+
+
+def _save_webp(img, fp, frames, quality):
+    """
+    Feed frames straight into libwebp's animation encoder, which keeps only
+    compressed data, so memory stays at about one decoded frame. Falls back
+    to Pillow's public writer, which holds all output frames.
+    """
+    first, duration = next(frames)
+    frames = chain([(first, duration)], frames)
+    loop = img.info.get("loop", 0)
+
+    encoder = _webp_encoder(first.size, loop)
+    if encoder is None:
+        frames = list(frames)
+        first.save(
+            fp,
+            format="WEBP",
+            save_all=True,
+            append_images=[frame for frame, _ in frames[1:]],
+            duration=[duration for _, duration in frames],
+            loop=loop,
+            quality=quality,
+        )
+        return
+
+    timestamp = 0
+    for frame, duration in frames:
+        encoder.add(frame.getim(), round(timestamp), False, float(quality), 100.0, 0)
+        timestamp += duration
+
+    encoder.add(None, round(timestamp), False, float(quality), 100.0, 0)
+    data = encoder.assemble(b"", b"", b"")
+    if data is None:
+        raise OSError("cannot write file as WebP (encoder returned None)")
+    fp.write(data)
+
+
+def save_animation(img, fp, format_name, transform, quality):
+    """
+    Write all frames of an animated image through transform, preserving
+    per-frame durations and the loop count.
+    """
+    frames = iter_frames(img, transform)
+
+    if format_name == "WEBP":
+        _save_webp(img, fp, frames, quality)
+        return
+
+    #Pillow's GIF writer diffs against earlier frames, so it buffers the
+    #output frames, but source frames are still decoded one at a time
+    first, _ = next(frames)
+    first.save(
+        fp,
+        format=format_name,
+        save_all=True,
+        append_images=(frame for frame, _ in frames),
+        loop=img.info.get("loop", 0),
+    )
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ImageProConfig(AppConfig):
     name = 'image_pro'
+
+    def ready(self):
+        #celery -A config inspect storage_stats
+        from . import inspect  # noqa: F401
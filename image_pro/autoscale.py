@@ -0,0 +1,83 @@
+import itertools
+import weakref
+
+from celery.signals import task_received
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+from celery.worker.control import inspect_command
+from django.conf import settings
+
+from .utils import estimate_job_memory
+
+
+PROCESS_TASK_NAME = "image_pro.tasks.process_image_task"
+
+#receipt order of reserved requests, which is the order the pool starts them in
+_received = weakref.WeakKeyDictionary()
+_sequence = itertools.count()
+
+
+@task_received.connect
+def _on_task_received(sender=None, request=None, **kwargs):
+    _received[request] = next(_sequence)
+
+
+def request_pixels(req):
+    """
+    Pixel count captured from the image header at upload and sent in the task
+    headers. Other tasks are treated as free.
+    """
+    if req.name != PROCESS_TASK_NAME:
+        return 0
+    return req.request_dict.get("image_pixels") or settings.IMAGE_DEFAULT_JOB_PIXELS
+
+
+def in_flight_cost():
+    pixels = sum(request_pixels(req) for req in state.active_requests)
+    return {
+        "active": len(state.active_requests),
+        "reserved": len(state.reserved_requests),
+        "pixels": pixels,
+        "memory_bytes": estimate_job_memory(pixels),
+        "memory_budget_bytes": settings.IMAGE_WORKER_MEMORY_BUDGET_BYTES,
+    }
+
+
+@inspect_command()
+def image_cost(state):
+    """
+    celery -A config inspect image_cost
+    """
+    return in_flight_cost()
+
+
+class CostAwareAutoscaler(Autoscaler):
+    """
+    Scales the pool between --autoscale min and max from the number of
+    reserved jobs, but only up to the number of jobs whose estimated memory
+    fits the worker budget. Jobs already running are always counted first,
+    then waiting jobs in the order the pool will start them, up to the first
+    that does not fit: a process added for a small job further back would
+    pick up the big one at the head instead. At least one job is admitted so
+    a single huge image still runs.
+
+    Enabled with CELERY_WORKER_AUTOSCALER.
+    """
+
+    @property
+    def qty(self):
+        budget = settings.IMAGE_WORKER_MEMORY_BUDGET_BYTES
+        active = state.active_requests
+        waiting = [req for req in state.reserved_requests if req not in active]
+
+        used = sum(estimate_job_memory(request_pixels(req)) for req in active)
+        admitted = len(active)
+
+        for req in sorted(waiting, key=lambda req: _received.get(req, 0)):
+            cost = estimate_job_memory(request_pixels(req))
+            if admitted and used + cost > budget:
+                break
+            used += cost
+            admitted += 1
+
+        return admitted
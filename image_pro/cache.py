@@ -0,0 +1,190 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from celery.worker.control import inspect_command
+from django.conf import settings
+from PIL import Image as PILImage
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "disk_hits": 0,
+    "disk_misses": 0,
+    "memory_hits": 0,
+    "memory_misses": 0,
+    "evictions": 0,
+}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def cache_stats():
+    """
+    Hit/miss counters of the cache in this worker process.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    for level in ("disk", "memory"):
+        total = stats[f"{level}_hits"] + stats[f"{level}_misses"]
+        stats[f"{level}_hit_rate"] = round(stats[f"{level}_hits"] / total, 3) if total else None
+
+    return stats
+
+
+@inspect_command()
+def original_cache_stats(state):
+    """
+    celery -A config inspect original_cache_stats
+    """
+    return cache_stats()
+
+
+def storage_version(field_file):
+    """
+    ETag of the stored object (S3), or its modified time for other storages.
+    A HEAD request is much cheaper than downloading the original again.
+    """
+    storage = field_file.storage
+    bucket = getattr(storage, "bucket", None)
+
+    if bucket is not None:
+        obj = bucket.Object(storage._normalize_name(field_file.name))
+        return obj.e_tag.strip('"')
+
+    return str(storage.get_modified_time(field_file.name).timestamp())
+
+
+def queue_for_original(name):
+    """
+    Routing hint: jobs for the same original always land on the same shard
+    queue, so the worker that already has it cached picks it up.
+    """
+    shards = settings.IMAGE_CACHE_ROUTING_SHARDS
+    if not shards:
+        return None
+
+    return f"images.shard{zlib.crc32(name.encode()) % shards}"
+
+
+class OriginalCache:
+    """
+    Size-bounded LRU cache of originals on the worker's local disk, plus an
+    optional small in-memory LRU of decoded images.
+
+    Entries are keyed by storage name and ETag. The disk cache is shared by
+    all prefork children of a worker, so recency is tracked with file mtimes
+    rather than in-process state.
+    """
+
+    def __init__(self, directory, max_bytes, max_decoded=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_decoded = max_decoded
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, name, version):
+        return hashlib.sha256(f"{name}:{version}".encode()).hexdigest()
+
+    def open(self, field_file):
+        key = self._key(field_file.name, storage_version(field_file))
+
+        if self.max_decoded:
+            with self._lock:
+                img = self._decoded.get(key)
+                if img is not None:
+                    self._decoded.move_to_end(key)
+            if img is not None:
+                _count("memory_hits")
+                return img.copy()
+            _count("memory_misses")
+
+        path = self._fetch(key, field_file)
+        img = PILImage.open(path)
+
+        #animations are decoded frame by frame, never cached whole
+        if self.max_decoded and not getattr(img, "is_animated", False):
+            img.load()
+            with self._lock:
+                self._decoded[key] = img.copy()
+                while len(self._decoded) > self.max_decoded:
+                    self._decoded.popitem(last=False)
+
+        return img
+
+    def prefetch(self, field_file):
+        """
+        Download an original into the disk cache ahead of its job.
+        """
+        self._fetch(self._key(field_file.name, storage_version(field_file)), field_file)
+
+    def _fetch(self, key, field_file):
+        path = os.path.join(self.directory, key)
+
+        try:
+            os.utime(path)
+            _count("disk_hits")
+            return path
+        except FileNotFoundError:
+            _count("disk_misses")
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as tmp, field_file.open("rb") as src:
+                shutil.copyfileobj(src, tmp, 1024 * 1024)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            field_file.close()
+
+        self._evict()
+        return path
+
+    def _evict(self):
+        entries = []
+        total = 0
+
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".part"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        #least recently used first
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            _count("evictions")
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+original_cache = OriginalCache(
+    settings.IMAGE_CACHE_DIR,
+    settings.IMAGE_CACHE_MAX_BYTES,
+    settings.IMAGE_DECODED_CACHE_SIZE,
+)
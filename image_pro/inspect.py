@@ -0,0 +1,15 @@
+"""
+Celery remote-control commands that are not tied to a worker subsystem.
+Imported from ImageProConfig.ready() so every worker registers them.
+"""
+from celery.worker.control import inspect_command
+
+
+@inspect_command()
+def storage_stats(state):
+    """
+    celery -A config inspect storage_stats
+    """
+    #boto3 is only loaded once storage is actually used
+    from config.storages import storage_metrics
+    return storage_metrics()
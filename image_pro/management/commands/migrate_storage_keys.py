@@ -0,0 +1,86 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from image_pro.models import Image
+from image_pro.storage_keys import UPLOAD_KINDS, image_key
+
+
+class Command(BaseCommand):
+    help = "Move existing image files to the hash-sharded key layout (image_pro/storage_keys.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--limit", type=int, default=0, help="Stop after this many images (0 = all)")
+        parser.add_argument("--keep-old", action="store_true", help="Copy without deleting the old objects")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def copy(self, old_name, new_name):
+        """
+        Copy old_name to new_name and return the name it was stored under.
+        """
+        storage = default_storage
+        bucket = getattr(storage, "bucket", None)
+
+        if bucket is not None:
+            #server-side copy on S3, no download/upload through this process
+            bucket.Object(storage._normalize_name(new_name)).copy(
+                {"Bucket": bucket.name, "Key": storage._normalize_name(old_name)}
+            )
+            return new_name
+
+        with storage.open(old_name) as fh:
+            #renamed if something is already at new_name
+            return storage.save(new_name, fh)
+
+    def handle(self, *args, **options):
+        fields = list(UPLOAD_KINDS)
+        moved = images_done = 0
+
+        queryset = Image.objects.only("id", *fields).order_by("id")
+        last_id = None
+
+        while True:
+            batch = queryset.filter(id__gt=last_id) if last_id else queryset
+            batch = list(batch[:options["batch_size"]])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for image in batch:
+                updates = {}
+                for field in fields:
+                    old_name = getattr(image, field).name
+                    if not old_name:
+                        continue
+
+                    new_name = image_key(UPLOAD_KINDS[field], image.id, old_name)
+                    if old_name == new_name:
+                        continue
+
+                    if options["dry_run"]:
+                        self.stdout.write(f"{old_name} -> {new_name}")
+                        continue
+
+                    if not default_storage.exists(old_name):
+                        self.stderr.write(f"Missing {old_name} for image {image.id}, skipping")
+                        continue
+
+                    updates[field] = (old_name, self.copy(old_name, new_name))
+
+                if updates:
+                    #point the row at the new keys before removing the old objects
+                    Image.objects.filter(id=image.id).update(
+                        **{field: new for field, (_old, new) in updates.items()}
+                    )
+                    if not options["keep_old"]:
+                        for old_name, _new in updates.values():
+                            default_storage.delete(old_name)
+                    moved += len(updates)
+
+                images_done += 1
+                if options["limit"] and images_done >= options["limit"]:
+                    self.stdout.write(self.style.SUCCESS(f"Moved {moved} files"))
+                    return
+
+            self.stdout.write(f"{images_done} images checked, {moved} files moved")
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} files"))
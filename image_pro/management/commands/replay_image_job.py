@@ -0,0 +1,209 @@
+import cProfile
+import io
+import json
+import pstats
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+
+from image_pro.cache import original_cache
+from image_pro.models import Image
+from image_pro.processing import encode_image, probe_image
+from image_pro.tasks import OutputSpool
+
+
+STAGES = ("fetch_original", "load_operations", "encode")
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the processing of process_image_task in this process and report "
+        "stage timings, hotspots and peak allocations. Read-only: --image and "
+        "--recent read rows and originals, but nothing is written back."
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument("--image", action="append", help="Image id (repeatable)")
+        source.add_argument("--file", help="Local image file")
+        source.add_argument("--recent", type=int, help="Replay a sample of the N most recent jobs")
+
+        parser.add_argument("--operations", help="Operations JSON, or @path to a JSON file (with --file)")
+        parser.add_argument("--status", choices=["completed", "failed"], help="With --recent: only this status")
+        parser.add_argument("--profile", action="store_true", help="cProfile hotspots across all replays")
+        parser.add_argument("--tracemalloc", action="store_true", help="Peak and top allocation sites")
+        parser.add_argument("--top", type=int, default=15)
+        parser.add_argument("--save-output", help="Write the (last) output to this path")
+
+    @contextmanager
+    def stage(self, timings, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    def load_operations(self, value):
+        if not value:
+            return []
+        if value.startswith("@"):
+            with open(value[1:]) as fh:
+                value = fh.read()
+
+        operations = json.loads(value)
+        return [(op["operation_type"], op.get("parameters", {})) for op in operations]
+
+    def jobs(self, options):
+        """
+        (label, open original, load operations, image format) per job.
+        """
+        if options["file"]:
+            path = options["file"]
+            with open(path, "rb") as fh:
+                image_format = probe_image(fh)["format"].lower().replace("jpeg", "jpg")
+            yield (
+                path,
+                lambda: PILImage.open(path),
+                lambda: self.load_operations(options["operations"]),
+                image_format,
+            )
+            return
+
+        if options["image"]:
+            images = Image.objects.filter(pk__in=options["image"])
+        else:
+            images = Image.objects.exclude(status="pending").order_by("-created_at")
+            if options["status"]:
+                images = images.filter(status=options["status"])
+            images = images[:options["recent"]]
+
+        images = list(images)
+        if not images:
+            raise CommandError("No matching images.")
+
+        for image in images:
+            yield (
+                f"{image.id} ({image.width}x{image.height}, {image.frame_count} frames, {image.status})",
+                lambda image=image: original_cache.open(image.original_image),
+                lambda image=image: [
+                    (op.operation_type, op.parameters)
+                    for op in image.operations.all().order_by("created_at")
+                ],
+                image.image_format,
+            )
+
+    def replay(self, job, options):
+        label, open_original, load_operations, image_format = job
+        timings = {}
+        result = {"label": label, "timings": timings, "error": None}
+
+        if options["tracemalloc"]:
+            tracemalloc.reset_peak()
+
+        try:
+            with self.stage(timings, "fetch_original"):
+                img = open_original()
+
+            with self.stage(timings, "load_operations"):
+                operations = load_operations()
+
+            with OutputSpool(max_size=settings.IMAGE_OUTPUT_SPOOL_MAX_BYTES) as output:
+                with self.stage(timings, "encode"):
+                    result["format"] = encode_image(img, output, operations, image_format)
+                result["output_bytes"] = output.tell()
+
+                if options["save_output"]:
+                    output.seek(0)
+                    with open(options["save_output"], "wb") as fh:
+                        fh.write(output.read())
+        except Exception as e:
+            #the point is to see where it failed
+            result["error"] = repr(e)
+
+        if options["tracemalloc"]:
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+
+        return result
+
+    def report_job(self, result):
+        timings = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in result["timings"].items())
+        line = f"{result['label']}: {timings}"
+
+        if "output_bytes" in result:
+            line += f" output={result['output_bytes'] / 1024:.1f}KB {result['format']}"
+        if "peak_bytes" in result:
+            line += f" peak_alloc={result['peak_bytes'] / 1024 / 1024:.1f}MB"
+        if result["error"]:
+            line += f" ERROR {result['error']}"
+
+        self.stdout.write(line)
+
+    def report_aggregate(self, results):
+        self.stdout.write(f"\n{len(results)} jobs, {sum(1 for r in results if r['error'])} failed")
+
+        for name in STAGES:
+            values = sorted(r["timings"][name] for r in results if name in r["timings"])
+            if not values:
+                continue
+            self.stdout.write(
+                f"  {name:<16} mean {sum(values) / len(values) * 1000:8.1f} ms  "
+                f"p95 {values[min(int(len(values) * 0.95), len(values) - 1)] * 1000:8.1f} ms  "
+                f"max {values[-1] * 1000:8.1f} ms"
+            )
+
+        peaks = [r["peak_bytes"] for r in results if "peak_bytes" in r]
+        if peaks:
+            self.stdout.write(f"  peak allocation  max {max(peaks) / 1024 / 1024:.1f} MB")
+
+    def handle(self, *args, **options):
+        if options["operations"] and not options["file"]:
+            raise CommandError("--operations is only used with --file; image replays use the stored operations.")
+
+        profiler = cProfile.Profile() if options["profile"] else None
+        if options["tracemalloc"]:
+            tracemalloc.start(25)
+
+        results = []
+        for job in self.jobs(options):
+            if profiler:
+                profiler.enable()
+            result = self.replay(job, options)
+            if profiler:
+                profiler.disable()
+
+            self.report_job(result)
+            results.append(result)
+
+        if len(results) > 1:
+            self.report_aggregate(results)
+
+        #Pillow's pixel buffers are not seen by tracemalloc, RSS covers them
+        self.stdout.write(f"Process peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+        if options["tracemalloc"]:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            self.stdout.write(f"\nTop allocation sites still held (of {len(results)} replays):")
+            for stat in snapshot.statistics("lineno")[:options["top"]]:
+                self.stdout.write(f"  {stat}")
+            tracemalloc.stop()
+
+        if profiler:
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.strip_dirs().sort_stats("cumulative").print_stats(options["top"])
+            self.stdout.write("\nHotspots (cumulative):")
+            self.stdout.write(stream.getvalue())
+
+            stream.seek(0)
+            stream.truncate()
+            stats.stream = stream
+            stats.sort_stats("tottime").print_stats(options["top"])
+            self.stdout.write("Hotspots (own time):")
+            self.stdout.write(stream.getvalue())
@@ -0,0 +1,288 @@
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+
+from image_pro.cache import original_cache
+from image_pro.models import Image
+from image_pro.tasks import encode_output, notify_image_event, save_output
+from image_pro.tracing import span
+from image_pro.utils import acquire_image_lease, release_image_lease
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by the threads of one process. acquire() may run the
+    bucket into debt and sleeps it off, so amounts above the rate still pass.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        if not self.rate:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+
+#set in each pool process by _init_worker
+_ops_limiter = RateLimiter(0)
+_bytes_limiter = RateLimiter(0)
+_notify = False
+
+
+def _init_worker(ops_rate, bytes_rate, notify):
+    global _ops_limiter, _bytes_limiter, _notify
+    _ops_limiter = RateLimiter(ops_rate)
+    _bytes_limiter = RateLimiter(bytes_rate)
+    _notify = notify
+
+
+def _storage_io(size):
+    _ops_limiter.acquire()
+    _bytes_limiter.acquire(size)
+
+
+def _reprocess(image_id):
+    """
+    The process_image_task pipeline for one image, without the status round
+    trip through "processing": the current output stays served until the new
+    one is stored over it. Returns "done" or "skipped".
+    """
+    lease = acquire_image_lease(image_id)
+    if not lease:
+        #a worker has it right now
+        return "skipped"
+
+    try:
+        image_obj = Image.objects.filter(id=image_id).first()
+        if image_obj is None:
+            return "skipped"
+
+        with span("reprocess_image", image_id=str(image_id)):
+            _storage_io(image_obj.file_size or 0)
+            with span("storage.fetch_original", key=image_obj.original_image.name):
+                img = original_cache.open(image_obj.original_image)
+
+            output = encode_output(image_obj, img)
+            old_name = image_obj.processed_image.name
+
+            _storage_io(output.tell())
+            save_output(image_obj, output)
+
+            #the processing timestamps keep describing the original job, so a
+            #bulk run doesn't skew estimate_processing_time or the admission
+            #drain rate with a burst of "completions"
+            image_obj.status = "completed"
+            image_obj.save(update_fields=["processed_image", "image_format", "status", "updated_at"])
+            if _notify:
+                notify_image_event(image_obj, "image.completed")
+
+            #same key unless the output format changed
+            if old_name and old_name != image_obj.processed_image.name:
+                _storage_io(0)
+                default_storage.delete(old_name)
+
+        return "done"
+    finally:
+        release_image_lease(image_id, lease)
+
+
+def _reprocess_chunk(image_ids):
+    counts = {"done": 0, "skipped": 0, "failed": []}
+
+    for image_id in image_ids:
+        try:
+            counts[_reprocess(image_id)] += 1
+        except Exception:
+            #the row and its current output are left as they were
+            logger.exception("Reprocessing image %s failed", image_id)
+            counts["failed"].append(str(image_id))
+
+    return counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Regenerate processed outputs of stored images on a local process pool, "
+        "e.g. after changing encoder settings. Resumable from a checkpoint file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--status", action="append", choices=["completed", "failed"],
+                            help="Images with this status (repeatable, default completed)")
+        parser.add_argument("--user", type=int, help="Only this user's images")
+        parser.add_argument("--created-after", help="ISO datetime")
+        parser.add_argument("--created-before", help="ISO datetime")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--chunk-size", type=int, default=100)
+        parser.add_argument("--max-storage-ops", type=float, default=0,
+                            help="Storage requests per second across all workers (0 = unlimited)")
+        parser.add_argument("--max-storage-mbps", type=float, default=0,
+                            help="Storage megabits per second across all workers (0 = unlimited)")
+        parser.add_argument("--notify", action="store_true", help="Send image.completed webhooks")
+        parser.add_argument("--checkpoint", default="reprocess_images.checkpoint.json")
+        parser.add_argument("--resume", action="store_true", help="Continue after the checkpoint")
+
+    def get_queryset(self, filters):
+        queryset = Image.objects.filter(status__in=filters["status"])
+
+        if filters["user"]:
+            queryset = queryset.filter(user_id=filters["user"])
+
+        for name, lookup in (("created_after", "created_at__gte"), ("created_before", "created_at__lt")):
+            if filters[name]:
+                value = parse_datetime(filters[name])
+                if value is None:
+                    raise CommandError(f"Invalid datetime for --{name.replace('_', '-')}: {filters[name]}")
+                queryset = queryset.filter(**{lookup: value})
+
+        return queryset.order_by("id")
+
+    def chunks(self, queryset, last_id, size):
+        """
+        Image ids in keyset order, size at a time; rows are never loaded here.
+        """
+        while True:
+            batch = queryset.filter(id__gt=last_id) if last_id else queryset
+            ids = list(batch.values_list("id", flat=True)[:size])
+            if not ids:
+                return
+            last_id = ids[-1]
+            yield ids
+
+    def load_checkpoint(self, path, filters, resume):
+        if not os.path.exists(path):
+            if resume:
+                raise CommandError(f"No checkpoint at {path}.")
+            return {"filters": filters, "last_id": None, "done": 0, "skipped": 0, "failed": []}
+
+        if not resume:
+            raise CommandError(f"{path} exists: pass --resume to continue it, or remove it to start over.")
+
+        with open(path) as fh:
+            state = json.load(fh)
+        if state["filters"] != filters:
+            raise CommandError(f"{path} was written for different filters: {state['filters']}")
+        return state
+
+    def save_checkpoint(self, path, state):
+        #never leave a half-written checkpoint behind
+        with open(f"{path}.tmp", "w") as fh:
+            json.dump(state, fh)
+        os.replace(f"{path}.tmp", path)
+
+    def finish_chunk(self, path, state, last_id, future):
+        counts = future.result()
+        state["done"] += counts["done"]
+        state["skipped"] += counts["skipped"]
+        state["failed"].extend(counts["failed"])
+        #results are taken in submission order, so everything up to here is handled
+        state["last_id"] = str(last_id)
+        self.save_checkpoint(path, state)
+        return counts["done"] + counts["skipped"] + len(counts["failed"])
+
+    def report(self, state, handled, total, started):
+        elapsed = time.monotonic() - started
+        rate = handled / elapsed if elapsed else 0
+        eta = f"{(total - handled) / rate / 60:.1f} min" if rate else "-"
+
+        self.stdout.write(
+            f"{handled}/{total} ({handled / max(total, 1):.0%}) done={state['done']} skipped={state['skipped']} "
+            f"failed={len(state['failed'])}  {rate:.1f} images/s  ETA {eta}"
+        )
+
+    def handle(self, *args, **options):
+        filters = {
+            "status": sorted(set(options["status"] or ["completed"])),
+            "user": options["user"],
+            "created_after": options["created_after"],
+            "created_before": options["created_before"],
+        }
+        workers = max(options["workers"], 1)
+        path = options["checkpoint"]
+
+        queryset = self.get_queryset(filters)
+        state = self.load_checkpoint(path, filters, options["resume"])
+
+        remaining = queryset.filter(id__gt=state["last_id"]) if state["last_id"] else queryset
+        total = remaining.count()
+        chunks = self.chunks(queryset, state["last_id"], options["chunk_size"])
+
+        first = next(chunks, None)
+        if first is None:
+            self.stdout.write(self.style.SUCCESS("Nothing to reprocess."))
+            return
+
+        #the pool forks all its processes on the first submit; they must not
+        #share this process's database connections, or its psycopg pool
+        #(DB_POOL_MODE=pool), which close_all() leaves open
+        connections.close_all()
+        for conn in connections.all():
+            if conn.alias in getattr(conn, "_connection_pools", ()):
+                conn.close_pool()
+
+        pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(
+                options["max_storage_ops"] / workers,
+                options["max_storage_mbps"] * 1024 * 1024 / 8 / workers,
+                options["notify"],
+            ),
+        )
+
+        self.stdout.write(f"Reprocessing {total} images on {workers} processes")
+        started = time.monotonic()
+        handled = 0
+        in_flight = deque()
+
+        try:
+            for ids in itertools.chain([first], chunks):
+                in_flight.append((ids[-1], pool.submit(_reprocess_chunk, ids)))
+
+                #bounded, so the id stream stays only a few chunks ahead
+                if len(in_flight) >= workers * 2:
+                    handled += self.finish_chunk(path, state, *in_flight.popleft())
+                    self.report(state, handled, total, started)
+
+            while in_flight:
+                handled += self.finish_chunk(path, state, *in_flight.popleft())
+                self.report(state, handled, total, started)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise CommandError(f"Interrupted. Rerun with --resume to continue after image {state['last_id']}.")
+
+        pool.shutdown()
+
+        message = f"Reprocessed {state['done']} images, skipped {state['skipped']}"
+        if state["failed"]:
+            message += f", {len(state['failed'])} failed (ids in {path})"
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,53 @@
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from image_pro.models import Image
+
+
+class Command(BaseCommand):
+    help = "Print the spans of a trace (by trace id or image id) from the file trace exporter."
+
+    def add_arguments(self, parser):
+        parser.add_argument("id", help="Trace id, or the id of an image")
+        parser.add_argument("--file", default=settings.TRACE_FILE_PATH)
+
+    def handle(self, *args, **options):
+        trace_id = options["id"]
+        try:
+            image = Image.objects.filter(pk=trace_id).only("trace_id").first()
+        except ValidationError:
+            image = None
+        if image:
+            trace_id = image.trace_id
+
+        try:
+            with open(options["file"]) as fh:
+                spans = [s for s in map(json.loads, fh) if s["trace_id"] == trace_id]
+        except FileNotFoundError:
+            raise CommandError(f"No trace file at {options['file']} (is TRACE_EXPORTER=file?)")
+
+        if not spans:
+            raise CommandError(f"No spans for trace {trace_id}")
+
+        children = {}
+        for s in spans:
+            children.setdefault(s["parent_id"], []).append(s)
+
+        known = {s["span_id"] for s in spans}
+        roots = [s for s in spans if s["parent_id"] not in known]
+        start = min(s["start_ns"] for s in spans)
+
+        def show(s, depth):
+            offset = (s["start_ns"] - start) / 1e6
+            error = f"  ERROR {s['error']}" if s["error"] else ""
+            self.stdout.write(
+                f"{offset:>10.1f} ms  {'  ' * depth}{s['name']} [{s['service']}] "
+                f"{s['duration_ms']:.1f} ms{error}"
+            )
+            for child in sorted(children.get(s["span_id"], []), key=lambda c: c["start_ns"]):
+                show(child, depth + 1)
+
+        self.stdout.write(f"Trace {trace_id}")
+        for root in sorted(roots, key=lambda r: r["start_ns"]):
+            show(root, 0)
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_pro', '0004_image_callback_url_webhookdelivery_webhookendpoint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image_format',
+            field=models.CharField(choices=[('jpg', 'JPEG'), ('png', 'PNG'), ('webp', 'WebP'), ('gif', 'GIF')], max_length=4),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_pro', '0005_alter_image_image_format'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imageoperation',
+            name='operation_type',
+            field=models.CharField(choices=[('resize', 'Resize'), ('convert', 'Convert'), ('filter', 'Filter'), ('compress', 'Compress'), ('brightness', 'Brightness'), ('contrast', 'Contrast'), ('gamma', 'Gamma'), ('levels', 'Levels'), ('threshold', 'Threshold')], default='resize', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-19 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_pro', '0006_alter_imageoperation_operation_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='preview_image',
+            field=models.ImageField(blank=True, null=True, upload_to='images/previews/'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='preview_placeholder',
+            field=models.TextField(blank=True),
+        ),
+    ]
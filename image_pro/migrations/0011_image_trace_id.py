@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_pro', '0010_image_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='trace_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-19 15:40
+
+import image_pro.storage_keys
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_pro', '0011_image_trace_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='original_image',
+            field=models.ImageField(upload_to=image_pro.storage_keys.original_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='processed_image',
+            field=models.ImageField(blank=True, null=True, upload_to=image_pro.storage_keys.processed_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='preview_image',
+            field=models.ImageField(blank=True, null=True, upload_to=image_pro.storage_keys.preview_upload_to),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-19 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_pro', '0013_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['processing_completed_at'], name='image_completed_at_idx'),
+        ),
+    ]
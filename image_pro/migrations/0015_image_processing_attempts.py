@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_pro', '0014_image_completed_at_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='processing_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
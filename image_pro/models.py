@@ -1,8 +1,10 @@
 import uuid
+import secrets
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
+from .storage_keys import original_upload_to, processed_upload_to, preview_upload_to
 
 User = get_user_model()
 
@@ -18,25 +20,59 @@ class Image(models.Model):
     IMAGE_FORMAT_CHOICES = (
         ("jpg", "JPEG"),
         ("png", "PNG"),
-        ("webp", "WebP")
+        ("webp", "WebP"),
+        ("gif", "GIF"),
     )
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="images", null=True, blank=True)
-    original_image = models.ImageField(upload_to="images/originals/")
-    processed_image = models.ImageField(upload_to="images/processed/", null=True, blank=True)
+    original_image = models.ImageField(upload_to=original_upload_to)
+    processed_image = models.ImageField(upload_to=processed_upload_to, null=True, blank=True)
     image_format = models.CharField(max_length=4, choices=IMAGE_FORMAT_CHOICES)
     is_anonymous = models.BooleanField(default=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     created_at = models.DateTimeField(auto_now_add=True)
+    #include in update_fields on status changes; bulk status polling relies on it
+    updated_at = models.DateTimeField(auto_now=True)
     download_expires_at = models.DateTimeField(null=True, blank=True)
     processing_started_at = models.DateTimeField(null=True, blank=True)
     processing_completed_at = models.DateTimeField(null=True, blank=True)
     estimated_ready_at = models.DateTimeField(null=True, blank=True)
+    #probed from the upload header
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    mode = models.CharField(max_length=10, blank=True)
+    frame_count = models.PositiveIntegerField(default=1)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    callback_url = models.URLField(max_length=500, null=True, blank=True)
+    preview_image = models.ImageField(upload_to=preview_upload_to, null=True, blank=True)
+    preview_placeholder = models.TextField(blank=True)
+
+    #trace of the upload request and its processing job (image_pro/tracing.py)
+    trace_id = models.CharField(max_length=32, blank=True)
+    #processing runs started, bounded by IMAGE_TASK_MAX_ATTEMPTS
+    processing_attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "updated_at"], name="image_user_updated_idx"),
+            models.Index(fields=["user", "created_at", "id"], name="image_user_created_idx"),
+            models.Index(fields=["user", "status", "created_at", "id"], name="image_user_status_idx"),
+            models.Index(fields=["processing_completed_at"], name="image_completed_at_idx"),
+        ]
 
     def __str__(self):
         return f"Image {self.id}"
 
+    @property
+    def pixels(self):
+        """
+        Pixels per frame, or None for images uploaded before probing.
+        """
+        if self.width and self.height:
+            return self.width * self.height
+        return None
+
 
 
 
@@ -45,7 +81,12 @@ class ImageOperation(models.Model):
         ("resize", "Resize"),
         ("convert", "Convert"),
         ("filter", "Filter"),
-        ("compress", "Compress")
+        ("compress", "Compress"),
+        ("brightness", "Brightness"),
+        ("contrast", "Contrast"),
+        ("gamma", "Gamma"),
+        ("levels", "Levels"),
+        ("threshold", "Threshold"),
     )
 
     image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="operations")
@@ -57,3 +98,78 @@ class ImageOperation(models.Model):
         return f"{self.operation_type} on Image {self.image.id}"
 
 
+
+def generate_webhook_secret():
+    return secrets.token_hex(32)
+
+
+class WebhookEndpoint(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="webhook")
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64, default=generate_webhook_secret)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Webhook for {self.user}"
+
+
+class WebhookDelivery(models.Model):
+    """
+    One event waiting to be delivered. Rows for the same url are sent
+    together as a batch by deliver_webhooks.
+    """
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("delivered", "Delivered"),
+        ("failed", "Failed"),
+    )
+
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="webhook_delivery_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.payload.get('event')} to {self.url}"
+
+
+class UploadSession(models.Model):
+    """
+    Resumable upload of an original in chunks (image_pro/uploads.py).
+    Finalizing creates the Image through the regular upload validation.
+    """
+    STATUS_CHOICES = (
+        ("open", "Open"),
+        ("completed", "Completed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions", null=True, blank=True)
+    is_anonymous = models.BooleanField(default=False)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    #raw operations JSON, validated again on finalize like a direct upload
+    operations = models.TextField()
+    callback_url = models.URLField(max_length=500, null=True, blank=True)
+    #storage names of the stored chunks, in offset order
+    chunks = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="open")
+    image = models.OneToOneField(Image, on_delete=models.SET_NULL, null=True, blank=True, related_name="upload_session")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.received}/{self.total_size})"
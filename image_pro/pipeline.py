@@ -0,0 +1,214 @@
+"""
+Pipelined worker mode (IMAGE_PIPELINE_MODE), overlapping storage I/O with
+pixel work across jobs:
+
+- The worker's main process sees tasks as soon as they are reserved and
+  pushes their originals' names to a per-worker Redis list. Each pool child
+  runs a few prefetch threads that pop names from it and download the
+  originals into the shared disk cache, so a child usually starts a job with
+  its original already local. The main process itself starts no threads, so
+  children forked later (autoscaling, max-tasks-per-child) never inherit a
+  half-held lock.
+- In each child, the upload of an encoded output and the final DB writes
+  run on a background I/O pool while the task returns and the child takes
+  the next job. The image lease stays held until the upload finishes, so a
+  redelivery never repeats the job; if the child dies first, the stuck-job
+  reaper re-queues it.
+
+Both stages are bounded: at most IMAGE_PIPELINE_PREFETCH originals are
+being fetched per child, and at most IMAGE_PIPELINE_PENDING_UPLOADS
+outputs wait per child, after which the next job blocks until one is done.
+Without a Redis cache (dev) there is no prefetching.
+"""
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from celery.signals import task_received, worker_process_init, worker_process_shutdown
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+
+PROCESS_TASK_NAME = "image_pro.tasks.process_image_task"
+#names waiting for a prefetch thread; older ones are dropped first
+PREFETCH_BACKLOG = 100
+
+logger = logging.getLogger(__name__)
+
+_io_pool = None
+_io_slots = None
+_io_pid = None
+
+_prefetch_pool = None
+_prefetch_stop = None
+
+
+def _redis():
+    if not hasattr(cache, "client"):
+        return None
+
+    try:
+        from django_redis import get_redis_connection
+    except ImportError:
+        return None
+    return get_redis_connection("default")
+
+
+def _prefetch_key(worker_pid):
+    return f"pipeline:prefetch:{socket.gethostname()}:{worker_pid}"
+
+
+def _uploads():
+    global _io_pool, _io_slots, _io_pid
+
+    #threads do not survive the fork into pool children
+    if _io_pool is None or _io_pid != os.getpid():
+        _io_pool = ThreadPoolExecutor(settings.IMAGE_PIPELINE_IO_THREADS, thread_name_prefix="image-io")
+        _io_slots = threading.BoundedSemaphore(settings.IMAGE_PIPELINE_PENDING_UPLOADS)
+        _io_pid = os.getpid()
+
+    return _io_pool, _io_slots
+
+
+def submit_upload(fn):
+    """
+    Run fn (store output, mark completed) on the I/O pool. Blocks while the
+    pending-upload buffer is full, which caps memory held by outputs.
+    """
+    pool, slots = _uploads()
+    if not slots.acquire(blocking=False):
+        #hand a pooled connection (DB_POOL_MODE=pool) back while waiting on
+        #the upload threads, which need one each to finish
+        close_old_connections()
+        slots.acquire()
+
+    def run():
+        try:
+            fn()
+        finally:
+            slots.release()
+
+    pool.submit(run)
+
+
+def drain_uploads():
+    global _io_pool
+
+    if _io_pool is not None and _io_pid == os.getpid():
+        _io_pool.shutdown(wait=True)
+        _io_pool = None
+
+
+def queue_prefetch(name):
+    """
+    Main process: hand an original to the children's prefetch threads.
+    """
+    redis = _redis()
+    if redis is None:
+        return
+
+    key = _prefetch_key(os.getpid())
+    pipe = redis.pipeline()
+    pipe.rpush(key, name)
+    pipe.ltrim(key, -PREFETCH_BACKLOG, -1)
+    #left behind by a worker that went away
+    pipe.expire(key, 300)
+    try:
+        pipe.execute()
+    except Exception as e:
+        #the job fetches it itself
+        logger.warning("Could not queue prefetch of %s: %s", name, e)
+
+
+def start_prefetcher():
+    """
+    Child process: start the prefetch threads, fed from the main process's list.
+    """
+    global _prefetch_pool, _prefetch_stop
+
+    redis = _redis()
+    if redis is None:
+        return
+
+    _prefetch_pool = ThreadPoolExecutor(settings.IMAGE_PIPELINE_PREFETCH, thread_name_prefix="image-prefetch")
+    _prefetch_stop = threading.Event()
+    slots = threading.BoundedSemaphore(settings.IMAGE_PIPELINE_PREFETCH)
+
+    threading.Thread(
+        target=_feed_prefetcher,
+        args=(redis, _prefetch_key(os.getppid()), slots, _prefetch_stop),
+        name="image-prefetch-feed",
+        daemon=True,
+    ).start()
+
+
+def stop_prefetcher():
+    if _prefetch_pool is not None:
+        _prefetch_stop.set()
+        _prefetch_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _feed_prefetcher(redis, key, slots, stop):
+    #only take a name when a thread is free to fetch it
+    while not stop.is_set():
+        if not slots.acquire(timeout=1):
+            continue
+
+        try:
+            item = redis.blpop(key, timeout=1)
+        except Exception as e:
+            logger.warning("Prefetch queue unavailable: %s", e)
+            item = None
+            stop.wait(1)
+
+        if item is None:
+            slots.release()
+            continue
+
+        try:
+            _prefetch_pool.submit(_prefetch, item[1].decode(), slots)
+        except RuntimeError:
+            #pool shut down while waiting
+            slots.release()
+
+
+def _prefetch(name, slots):
+    from django.db.models.fields.files import FieldFile
+    from .cache import original_cache
+    from .models import Image
+
+    try:
+        field_file = FieldFile(None, Image._meta.get_field("original_image"), name)
+        original_cache.prefetch(field_file)
+    except Exception as e:
+        #the job fetches it itself
+        logger.warning("Prefetch of %s failed: %s", name, e)
+    finally:
+        slots.release()
+
+
+@task_received.connect
+def _on_task_received(sender=None, request=None, **kwargs):
+    #main worker process, when a task is reserved
+    if not settings.IMAGE_PIPELINE_MODE or request.name != PROCESS_TASK_NAME:
+        return
+
+    name = request.request_dict.get("original_name")
+    if name:
+        queue_prefetch(name)
+
+
+@worker_process_init.connect
+def _on_child_init(**kwargs):
+    if settings.IMAGE_PIPELINE_MODE:
+        start_prefetcher()
+
+
+@worker_process_shutdown.connect
+def _on_child_shutdown(**kwargs):
+    stop_prefetcher()
+    #finish pending uploads before the child exits
+    drain_uploads()
@@ -0,0 +1,236 @@
+import base64
+import os
+import struct
+from io import BytesIO
+
+from PIL import Image as PILImage, ImageFilter
+
+from .animation import is_animated, ANIMATED_FORMATS, save_animation
+
+
+FORMAT_MAP = {
+    "jpg": "JPEG",
+    "jpeg": "JPEG",
+    "png": "PNG",
+    "webp": "WEBP",
+    "gif": "GIF",
+}
+
+DEFAULT_QUALITY = 85
+
+
+class TruncatedImageError(ValueError):
+    pass
+
+
+def _read_tail(fp, size, length=1024):
+    fp.seek(max(size - length, 0))
+    return fp.read(length)
+
+
+def _check_complete(fp, format_name, size):
+    """
+    Cheap end-of-file checks that catch truncated uploads without decoding.
+    """
+    if format_name == "JPEG":
+        #EOI marker; some cameras append a little data after it
+        complete = b"\xff\xd9" in _read_tail(fp, size)
+    elif format_name == "PNG":
+        complete = b"IEND" in _read_tail(fp, size, 64)
+    elif format_name == "GIF":
+        #trailer byte last; 0x3b also occurs in LZW data, so only its position
+        #counts. Some writers pad with NULs after it
+        complete = _read_tail(fp, size, 16).rstrip(b"\x00").endswith(b"\x3b")
+    elif format_name == "WEBP":
+        fp.seek(4)
+        complete = struct.unpack("<I", fp.read(4))[0] + 8 <= size
+    else:
+        complete = True
+
+    if not complete:
+        raise TruncatedImageError(f"Truncated {format_name} file.")
+
+
+def probe_image(fp):
+    """
+    Read format, dimensions, mode and frame count from the image header
+    and check the file is not truncated. Pixel data is never decoded.
+    """
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    fp.seek(0)
+
+    img = PILImage.open(fp)
+    info = {
+        "format": img.format,
+        "width": img.width,
+        "height": img.height,
+        "mode": img.mode,
+        "frame_count": getattr(img, "n_frames", 1),
+        "file_size": size,
+    }
+
+    _check_complete(fp, img.format, size)
+    fp.seek(0)
+    return info
+
+
+def output_settings(operations, image_format):
+    """
+    Output format and quality after compress/convert operations.
+    Operations are (operation_type, parameters) pairs in order.
+    """
+    quality = DEFAULT_QUALITY
+
+    for op_type, params in operations:
+        if op_type == "compress":
+            quality = params.get("quality", DEFAULT_QUALITY)
+
+        elif op_type == "convert":
+            new_format = params.get("format")
+            if new_format:
+                image_format = new_format.lower()
+
+    return image_format, quality
+
+
+POINTWISE_OPERATIONS = ("brightness", "contrast", "gamma", "levels", "threshold")
+
+IDENTITY_TABLE = list(range(256))
+
+
+def _clamp(value):
+    return max(0, min(255, int(round(value))))
+
+
+def pointwise_table(op_type, params):
+    """
+    256-entry lookup table for one pointwise operation.
+    """
+    if op_type == "brightness":
+        factor = float(params["factor"])
+        return [_clamp(v * factor) for v in range(256)]
+
+    if op_type == "contrast":
+        #around mid-grey, so the table doesn't depend on image content
+        factor = float(params["factor"])
+        return [_clamp((v - 128) * factor + 128) for v in range(256)]
+
+    if op_type == "gamma":
+        exponent = 1 / float(params["value"])
+        return [_clamp(255 * (v / 255) ** exponent) for v in range(256)]
+
+    if op_type == "levels":
+        black = params["black"]
+        scale = 255 / (params["white"] - black)
+        return [_clamp((v - black) * scale) for v in range(256)]
+
+    if op_type == "threshold":
+        cutoff = params["value"]
+        return [255 if v >= cutoff else 0 for v in range(256)]
+
+    raise ValueError(f"Unknown pointwise operation '{op_type}'")
+
+
+def _apply_table(img, table):
+    """
+    One point() pass over the colour bands; alpha is left untouched.
+    """
+    if table is None:
+        return img
+
+    if img.mode not in ("L", "LA", "RGB", "RGBA"):
+        img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+
+    lut = []
+    for band in img.getbands():
+        lut.extend(IDENTITY_TABLE if band == "A" else table)
+
+    return img.point(lut)
+
+
+def apply_operations(img, operations):
+    """
+    Apply the pixel operations (resize, filter, pointwise adjustments) to a
+    single frame. Consecutive pointwise operations are composed into a
+    single lookup table, so a chain of them costs one pass over the pixels;
+    grayscale flushes the table since it mixes channels.
+    """
+    table = None
+
+    for op_type, params in operations:
+        if op_type in POINTWISE_OPERATIONS:
+            step = pointwise_table(op_type, params)
+            table = step if table is None else [step[v] for v in table]
+            continue
+
+        if op_type not in ("resize", "filter"):
+            #compress/convert only affect encoding
+            continue
+
+        img = _apply_table(img, table)
+        table = None
+
+        if op_type == "resize":
+            width = params.get("width")
+            height = params.get("height")
+
+            if width and height:
+                img = img.resize((int(width), int(height)))
+
+        elif op_type == "filter":
+            filter_type = params.get("type")
+
+            if filter_type == "grayscale":
+                img = img.convert("L")
+            elif filter_type == "blur":
+                img = img.filter(ImageFilter.BLUR)
+            elif filter_type == "sharpen":
+                img = img.filter(ImageFilter.SHARPEN)
+
+    return _apply_table(img, table)
+
+
+def encode_image(img, fp, operations, image_format):
+    """
+    Run the operations on img and write the result to fp.
+    Animated inputs keep all frames when the output format supports it,
+    otherwise only the first frame is used. Returns the output format.
+    """
+    image_format, quality = output_settings(operations, image_format)
+    format_name = FORMAT_MAP.get(image_format.lower(), image_format.upper())
+
+    if is_animated(img) and format_name in ANIMATED_FORMATS:
+        save_animation(img, fp, format_name, lambda frame: apply_operations(frame, operations), quality)
+        return image_format
+
+    img = apply_operations(img, operations)
+
+    #e.g. first frame of a GIF or a transparent PNG converted to jpg
+    if format_name == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        img = img.convert("RGB")
+
+    img.save(fp, format=format_name, quality=quality)
+    return image_format
+
+
+def make_preview(img, size=256, placeholder_size=16):
+    """
+    Small WebP preview and an inline LQIP placeholder (data URI) from the
+    first frame. thumbnail() lets JPEG decode at reduced resolution (draft
+    mode), so large originals are never fully decoded.
+    """
+    img.thumbnail((size, size), reducing_gap=1.0)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+
+    preview = BytesIO()
+    img.save(preview, format="WEBP", quality=60, method=0)
+
+    tiny = img.copy()
+    tiny.thumbnail((placeholder_size, placeholder_size))
+    placeholder = BytesIO()
+    tiny.save(placeholder, format="WEBP", quality=30, method=0)
+
+    data_uri = "data:image/webp;base64," + base64.b64encode(placeholder.getvalue()).decode()
+    return preview.getvalue(), data_uri
@@ -0,0 +1,306 @@
+"""
+Per-tenant fair scheduling of process_image_task.
+
+Jobs are not sent to the broker directly. enqueue_image() appends them to
+a Redis list per tenant (one per user, one shared by anonymous uploads),
+and dispatch() feeds the broker from those lists with deficit round-robin:
+each visit gives a tenant quantum x weight cost units, and it may send jobs
+while their estimated cost fits its deficit. The broker queue is only kept
+IMAGE_FAIR_DISPATCH_DEPTH deep, so a large batch from one user waits in its
+own list instead of in front of everybody else.
+
+Dispatch runs after every enqueue, after every finished job and from beat.
+Without a Redis cache (dev) jobs go straight to the broker.
+"""
+import json
+import logging
+import time
+
+from celery import current_app
+from celery.worker.control import inspect_command
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+
+
+ACTIVE_KEY = "fair:active"
+DEFICIT_KEY = "fair:deficit"
+WEIGHT_KEY = "fair:weight"
+SEEN_KEY = "fair:seen"
+DISPATCH_LOCK_KEY = "fair:dispatch-lock"
+WAIT_SAMPLES = 1000
+#tenants drop out of SEEN_KEY (and fair_queue stats) a day after their last job
+SEEN_RETENTION_SECONDS = 86400
+
+logger = logging.getLogger(__name__)
+
+
+#append a job; a tenant whose list was empty joins the round
+ENQUEUE_SCRIPT = """
+local length = redis.call('RPUSH', KEYS[2], ARGV[2])
+if length == 1 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+return length
+"""
+
+#one round-robin visit: add the quantum, pop jobs while their cost fits,
+#then move the tenant to the back of the round or drop it when drained
+VISIT_SCRIPT = """
+local deficit = tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0') + tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local jobs = {}
+
+while #jobs < limit do
+    local head = redis.call('LINDEX', KEYS[2], 0)
+    if not head then
+        break
+    end
+    local cost = tonumber(cjson.decode(head)['cost'])
+    if cost > deficit then
+        break
+    end
+    redis.call('LPOP', KEYS[2])
+    deficit = deficit - cost
+    table.insert(jobs, head)
+end
+
+redis.call('LREM', KEYS[1], 0, ARGV[1])
+if redis.call('LLEN', KEYS[2]) == 0 then
+    redis.call('HDEL', KEYS[3], ARGV[1])
+else
+    redis.call('HSET', KEYS[3], ARGV[1], tostring(deficit))
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+return jobs
+"""
+
+#undo a visit whose jobs could not be sent: back to the head of the list
+#with their cost returned to the deficit, and the tenant first in the round
+REQUEUE_SCRIPT = """
+for i = #ARGV, 3, -1 do
+    redis.call('LPUSH', KEYS[2], ARGV[i])
+end
+redis.call('HINCRBYFLOAT', KEYS[3], ARGV[1], ARGV[2])
+redis.call('LREM', KEYS[1], 0, ARGV[1])
+redis.call('LPUSH', KEYS[1], ARGV[1])
+return redis.call('LLEN', KEYS[2])
+"""
+
+
+def _redis():
+    if not settings.IMAGE_FAIR_SCHEDULING or not hasattr(cache, "client"):
+        return None
+
+    try:
+        from django_redis import get_redis_connection
+    except ImportError:
+        return None
+    return get_redis_connection("default")
+
+
+def _queue_key(tenant):
+    return f"fair:queue:{tenant}"
+
+
+def _waits_key(tenant):
+    return f"fair:waits:{tenant}"
+
+
+def tenant_for(image):
+    """
+    (tenant, tier) of an image. Authenticated users get the weight of the
+    first group they belong to that has one in IMAGE_FAIR_WEIGHTS, else "user".
+    """
+    if image.user_id is None:
+        return "anon", "anon"
+
+    weights = settings.IMAGE_FAIR_WEIGHTS
+    tier = Group.objects.filter(user=image.user_id, name__in=weights).values_list("name", flat=True).first()
+    return f"user:{image.user_id}", tier or "user"
+
+
+def broker_queue_depth(queue):
+    """
+    Messages waiting in a broker queue (not counting ones already reserved by workers).
+    """
+    with current_app.connection_for_read() as conn:
+        try:
+            return conn.default_channel.queue_declare(queue=queue, passive=True).message_count
+        except conn.channel_errors:
+            #declared on first publish
+            return 0
+
+
+def process_queues():
+    shards = settings.IMAGE_CACHE_ROUTING_SHARDS
+    if shards:
+        return [f"images.shard{i}" for i in range(shards)]
+    return [current_app.conf.task_default_queue]
+
+
+def submit(job, tenant, tier, cost):
+    """
+    Hold a job in its tenant's list and run a dispatch pass. job holds the
+    apply_async options: {"queue": ..., "headers": {...}}.
+    Returns False when fair scheduling is off and the caller should send it.
+    """
+    redis = _redis()
+    if redis is None:
+        return False
+
+    job = dict(job, cost=max(cost, 0.01))
+    job["headers"] = dict(job.get("headers") or {}, fair_tenant=tenant)
+    weight = settings.IMAGE_FAIR_WEIGHTS.get(tier, 1)
+
+    redis.eval(
+        ENQUEUE_SCRIPT, 3, ACTIVE_KEY, _queue_key(tenant), WEIGHT_KEY,
+        tenant, json.dumps(job), weight,
+    )
+    dispatch()
+    return True
+
+
+def dispatch():
+    """
+    Move jobs from tenant lists to the broker until the process queues hold
+    IMAGE_FAIR_DISPATCH_DEPTH messages. Only one dispatcher runs at a time;
+    a pass that finds the lock taken is covered by the running one or the next.
+    """
+    redis = _redis()
+    if redis is None:
+        return 0
+
+    if not cache.add(DISPATCH_LOCK_KEY, 1, timeout=30):
+        return 0
+
+    from .tasks import process_image_task
+
+    sent = 0
+    try:
+        slots = settings.IMAGE_FAIR_DISPATCH_DEPTH - sum(broker_queue_depth(q) for q in process_queues())
+        quantum = settings.IMAGE_FAIR_QUANTUM
+
+        #bounded so a pass never spins on a very expensive job
+        for _ in range(1000):
+            if slots <= 0:
+                break
+
+            tenants = [t.decode() for t in redis.lrange(ACTIVE_KEY, 0, -1)]
+            if not tenants:
+                break
+
+            weights = redis.hmget(WEIGHT_KEY, tenants)
+            for tenant, weight in zip(tenants, weights):
+                jobs = redis.eval(
+                    VISIT_SCRIPT, 3, ACTIVE_KEY, _queue_key(tenant), DEFICIT_KEY,
+                    tenant, quantum * float(weight or 1), slots,
+                )
+                for index, raw in enumerate(jobs):
+                    job = json.loads(raw)
+                    options = {"headers": job["headers"]}
+                    if job.get("queue"):
+                        options["queue"] = job["queue"]
+
+                    try:
+                        process_image_task.apply_async((job["image_id"],), **options)
+                    except Exception:
+                        #keep them held; the next pass (beat) sends them
+                        _requeue(redis, tenant, jobs[index:])
+                        logger.warning("Fair dispatch could not reach the broker", exc_info=True)
+                        return sent + index
+
+                slots -= len(jobs)
+                sent += len(jobs)
+                if slots <= 0:
+                    break
+    finally:
+        cache.delete(DISPATCH_LOCK_KEY)
+
+    return sent
+
+
+def _requeue(redis, tenant, jobs):
+    cost = sum(json.loads(raw)["cost"] for raw in jobs)
+    redis.eval(
+        REQUEUE_SCRIPT, 3, ACTIVE_KEY, _queue_key(tenant), DEFICIT_KEY,
+        tenant, cost, *jobs,
+    )
+
+
+def held_jobs():
+    """
+    Jobs waiting in tenant lists, not yet sent to the broker.
+    """
+    redis = _redis()
+    if redis is None:
+        return 0
+
+    tenants = [t.decode() for t in redis.lrange(ACTIVE_KEY, 0, -1)]
+    if not tenants:
+        return 0
+
+    pipe = redis.pipeline()
+    for tenant in tenants:
+        pipe.llen(_queue_key(tenant))
+    return sum(pipe.execute())
+
+
+def record_queue_wait(tenant, enqueued_ns):
+    """
+    Called when a job starts: keep the latest WAIT_SAMPLES waits per tenant.
+    """
+    redis = _redis()
+    if redis is None or not tenant or not enqueued_ns:
+        return
+
+    wait = (time.time_ns() - int(enqueued_ns)) / 1e9
+    key = _waits_key(tenant)
+    pipe = redis.pipeline()
+    pipe.lpush(key, f"{wait:.3f}")
+    pipe.ltrim(key, 0, WAIT_SAMPLES - 1)
+    pipe.expire(key, 86400)
+    pipe.zadd(SEEN_KEY, {tenant: time.time()})
+    pipe.zremrangebyscore(SEEN_KEY, "-inf", time.time() - SEEN_RETENTION_SECONDS)
+    pipe.execute()
+
+
+def _percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def fair_queue_stats(since_seconds=3600):
+    """
+    Per-tenant pending jobs, weight and queue wait percentiles (seconds) for
+    tenants that started a job in the last since_seconds.
+    """
+    redis = _redis()
+    if redis is None:
+        return {}
+
+    tenants = {t.decode() for t in redis.zrangebyscore(SEEN_KEY, time.time() - since_seconds, "+inf")}
+    tenants.update(t.decode() for t in redis.lrange(ACTIVE_KEY, 0, -1))
+
+    stats = {}
+    for tenant in sorted(tenants):
+        waits = sorted(float(w) for w in redis.lrange(_waits_key(tenant), 0, -1))
+        weight = redis.hget(WEIGHT_KEY, tenant)
+        stats[tenant] = {
+            "pending": redis.llen(_queue_key(tenant)),
+            "weight": float(weight) if weight else None,
+            "samples": len(waits),
+            "wait_p50": _percentile(waits, 0.5) if waits else None,
+            "wait_p95": _percentile(waits, 0.95) if waits else None,
+            "wait_p99": _percentile(waits, 0.99) if waits else None,
+        }
+
+    return stats
+
+
+@inspect_command()
+def fair_queue(state):
+    """
+    celery -A config inspect fair_queue
+    """
+    return fair_queue_stats()
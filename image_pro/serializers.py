@@ -1,10 +1,54 @@
 import json
-from rest_framework import serializers
+import requests
+from rest_framework import serializers, exceptions
 from rest_framework.reverse import reverse
-from PIL import Image as PILImage
 from django.utils import timezone
 from datetime import timedelta
-from .models import Image, ImageOperation
+from django.conf import settings
+from .models import Image, ImageOperation, WebhookEndpoint, UploadSession
+from .tracing import current_trace_id, span
+from .throttling import ComputeCostBudget
+from .utils import estimate_job_cost
+from .webhooks import UnsafeWebhookURL, check_webhook_url
+
+
+def validate_webhook_url(value):
+    if value and not settings.WEBHOOK_ALLOW_HTTP and not value.startswith("https://"):
+        raise serializers.ValidationError("Webhook URLs must use https.")
+    if value:
+        try:
+            check_webhook_url(value)
+        except (UnsafeWebhookURL, requests.ConnectionError) as e:
+            raise serializers.ValidationError(str(e))
+    return value
+
+
+def validate_callback_url(value, request):
+    """
+    Callback deliveries are signed with the owner's webhook endpoint secret,
+    or WEBHOOK_DEFAULT_SECRET; with neither they would go out unsigned.
+    """
+    value = validate_webhook_url(value)
+    if value and not settings.WEBHOOK_DEFAULT_SECRET:
+        user = request.user
+        if not user.is_authenticated or getattr(user, "webhook", None) is None:
+            raise serializers.ValidationError(
+                "callback_url needs a webhook endpoint (/api/webhook/) to sign deliveries."
+            )
+    return value
+
+
+def max_upload_size(user):
+    return 10 * 1024 * 1024 if user.is_authenticated else 2 * 1024 * 1024
+
+
+def validate_number(params, key, low, high, label):
+    value = params.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise serializers.ValidationError(f"{label} requires a numeric '{key}'.")
+    if value < low or value > high:
+        raise serializers.ValidationError(f"{label} '{key}' must be between {low} and {high}.")
+    return value
 
 
 class ImageOperationSerializer(serializers.ModelSerializer):
@@ -37,7 +81,7 @@ class ImageOperationSerializer(serializers.ModelSerializer):
                 )
         
         if op_type == "convert":
-            allowed_formats = ["jpg", "png", "webp"]
+            allowed_formats = ["jpg", "png", "webp", "gif"]
             new_format = params.get("format")
             if not new_format:
                 raise serializers.ValidationError(
@@ -48,13 +92,35 @@ class ImageOperationSerializer(serializers.ModelSerializer):
                     f"Invalid format '{new_format}'. Allowed: {', '.join(allowed_formats)}"
                 )
 
+        if op_type == "brightness":
+            validate_number(params, "factor", 0, 10, "Brightness")
+
+        if op_type == "contrast":
+            validate_number(params, "factor", 0, 10, "Contrast")
+
+        if op_type == "gamma":
+            validate_number(params, "value", 0.1, 10, "Gamma")
+
+        if op_type == "levels":
+            black = validate_number(params, "black", 0, 254, "Levels")
+            white = validate_number(params, "white", 1, 255, "Levels")
+            if black >= white:
+                raise serializers.ValidationError(
+                    "Levels 'black' must be lower than 'white'."
+                )
+
+        if op_type == "threshold":
+            validate_number(params, "value", 0, 255, "Threshold")
+
         return data
 
 
 class ImageUploadSerializer(serializers.ModelSerializer):
-    original_image = serializers.ImageField(write_only=True) 
+    #FileField: the header probe in validate() replaces ImageField's full verify()
+    original_image = serializers.FileField(write_only=True)
     operations = serializers.CharField(write_only=True)
     detail_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
@@ -63,11 +129,14 @@ class ImageUploadSerializer(serializers.ModelSerializer):
             "original_image",
             "image_format",
             "operations",
+            "callback_url",
             "status",
             "detail_url",
+            "download_url",
             "created_at",
         ]
-        read_only_fields = ["id", "status", "created_at", "detail_url", "image_format"]
+        read_only_fields = ["id", "status", "created_at", "detail_url", "download_url", "image_format"]
+        extra_kwargs = {"callback_url": {"write_only": True}}
     
     def get_detail_url(self, obj):
         request = self.context.get("request")
@@ -76,6 +145,12 @@ class ImageUploadSerializer(serializers.ModelSerializer):
             kwargs={"pk": obj.pk},
             request=request
         )
+
+    def get_download_url(self, obj):
+        #set when the job finished inline (?sync=true)
+        if obj.status != "completed":
+            return None
+        return reverse("images-download", kwargs={"pk": obj.pk}, request=self.context.get("request"))
     
 
     def validate(self, data):
@@ -83,32 +158,43 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         image_file = data.get("original_image")
         operations = data.get("operations", [])
 
-        #auto-detect image format
+        #file size, checked before reading any of the file
+        max_size = max_upload_size(request.user)
+        if image_file and image_file.size > max_size:
+            raise serializers.ValidationError(
+                f"File size exceeds allowed limit ({max_size // (1024*1024)}MB)."
+            )
+
+        #auto-detect image format and metadata from the header only
         if image_file:
+            #Pillow is only needed on upload, keep it off the import path
+            from .processing import probe_image, TruncatedImageError
+
             try:
-                pil_image = PILImage.open(image_file)
-                format_detected = pil_image.format.lower()
+                probed = probe_image(image_file)
+            except TruncatedImageError:
+                raise serializers.ValidationError("Image file is truncated.")
             except Exception:
                 raise serializers.ValidationError("Invalid image file.")
 
+            format_detected = probed["format"].lower()
+
             #convert jpeg to jpg
             if format_detected == "jpeg":
                 format_detected = "jpg"
 
-            allowed_formats = ["jpg", "png", "webp"]
+            allowed_formats = ["jpg", "png", "webp", "gif"]
             if format_detected not in allowed_formats:
                 raise serializers.ValidationError(
                     f"Unsupported image format '{format_detected}'. Allowed: {', '.join(allowed_formats)}"
                 )
 
-            data["image_format"] = format_detected 
-
-        #file size
-        max_size = 10 * 1024 * 1024 if request.user.is_authenticated else 2 * 1024 * 1024
-        if image_file and image_file.size > max_size:
-            raise serializers.ValidationError(
-                f"File size exceeds allowed limit ({max_size // (1024*1024)}MB)."
-            )
+            data["image_format"] = format_detected
+            data["width"] = probed["width"]
+            data["height"] = probed["height"]
+            data["mode"] = probed["mode"]
+            data["frame_count"] = probed["frame_count"]
+            data["file_size"] = probed["file_size"]
 
         #compression quality
         for op in operations:
@@ -129,8 +215,36 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         if not request.user.is_authenticated and len(operations) > 2:
             raise serializers.ValidationError("Anonymous users can only perform 2 operations")
 
+        #charge the compute budget last, only for otherwise valid uploads
+        if image_file:
+            #animations are processed frame by frame: memory per frame, cost per frame
+            cost = estimate_job_cost(data["width"] * data["height"] * data["frame_count"], operations)
+            self.job_cost = cost
+            allowed, _, wait = ComputeCostBudget(request).charge(cost)
+            if not allowed:
+                raise exceptions.Throttled(
+                    wait=wait,
+                    detail="Compute budget exceeded for this upload."
+                )
+
         return data
 
+    def inline_eligible(self, image):
+        """
+        Opt-in (?sync=true) and only for small, cheap, single-frame jobs.
+        """
+        return (
+            self.context.get("inline")
+            and settings.IMAGE_INLINE_MAX_COST > 0
+            and getattr(self, "job_cost", None) is not None
+            and self.job_cost <= settings.IMAGE_INLINE_MAX_COST
+            and image.file_size <= settings.IMAGE_INLINE_MAX_BYTES
+            and image.frame_count == 1
+        )
+
+    def validate_callback_url(self, value):
+        return validate_callback_url(value, self.context["request"])
+
     def validate_operations(self, value):
         try:
             operations = json.loads(value)
@@ -161,25 +275,41 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         operations_data = validated_data.pop("operations", [])
         request = self.context["request"]
 
-        image = Image.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            is_anonymous=not request.user.is_authenticated,
-            status="pending",
-            #auto expiry of undownloaded images
-            download_expires_at=timezone.now() + (
-                timedelta(hours=1) if request.user.is_authenticated else timedelta(minutes=10)
-            ),
-            **validated_data
-        )
-        for op_data in operations_data:
-            ImageOperation.objects.create(
-                image=image,
-                **op_data
+        #includes uploading the original to storage
+        with span("db.create_image", bytes=validated_data.get("file_size") or 0):
+            image = Image.objects.create(
+                user=request.user if request.user.is_authenticated else None,
+                is_anonymous=not request.user.is_authenticated,
+                status="pending",
+                #auto expiry of undownloaded images
+                download_expires_at=timezone.now() + (
+                    timedelta(hours=1) if request.user.is_authenticated else timedelta(minutes=10)
+                ),
+                trace_id=current_trace_id(),
+                **validated_data
             )
+        with span("db.create_operations", count=len(operations_data)):
+            for op_data in operations_data:
+                ImageOperation.objects.create(
+                    image=image,
+                    **op_data
+                )
+
 
+        from .tasks import enqueue_image, generate_preview_task, process_inline
+        with span("celery.enqueue"):
+            generate_preview_task.delay(image.id)
 
-        from .tasks import process_image_task
-        process_image_task.delay(image.id)
+        if self.inline_eligible(image):
+            original = validated_data["original_image"]
+            original.seek(0)
+            finished = process_inline(image, original.read(), settings.IMAGE_INLINE_BUDGET_MS / 1000)
+            if finished is not None:
+                #done, or still finishing on its own thread; never queued twice
+                return image
+
+        with span("celery.enqueue"):
+            enqueue_image(image)
 
         return image
 
@@ -187,6 +317,7 @@ class ImageUploadSerializer(serializers.ModelSerializer):
 class ImageDetailSerializer(serializers.ModelSerializer):
     download_url = serializers.SerializerMethodField()
     seconds_remaining = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
     class Meta:
         model = Image
         fields = [
@@ -195,6 +326,9 @@ class ImageDetailSerializer(serializers.ModelSerializer):
             "estimated_ready_at",
             "seconds_remaining",
             "download_url",
+            "preview_url",
+            "preview_placeholder",
+            "trace_id",
             "created_at",
         ]
 
@@ -211,6 +345,14 @@ class ImageDetailSerializer(serializers.ModelSerializer):
         return None
     
 
+    def get_preview_url(self, obj):
+        if not obj.preview_image:
+            return None
+
+        url = obj.preview_image.url
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
+
     def get_seconds_remaining(self, obj):
         if obj.status == "pending":
             return 8
@@ -220,3 +362,105 @@ class ImageDetailSerializer(serializers.ModelSerializer):
             return max(int(remaining.total_seconds()), 0)
 
         return None
+
+
+class ImageListSerializer(serializers.Serializer):
+    """
+    Slim row for the list endpoint, built from values() dicts. The download
+    URL is the list URL plus the id, so reverse() runs once per page.
+    """
+    id = serializers.UUIDField()
+    status = serializers.CharField()
+    image_format = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    download_url = serializers.SerializerMethodField()
+
+    LIST_FIELDS = ["id", "status", "image_format", "created_at"]
+
+    def get_download_url(self, obj):
+        if obj["status"] != "completed":
+            return None
+
+        if "images_url" not in self.context:
+            self.context["images_url"] = reverse("images-list", request=self.context.get("request"))
+        return f"{self.context['images_url']}{obj['id']}/download/"
+
+
+class ImageListQuerySerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Image.STATUS_CHOICES, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+
+class BulkStatusQuerySerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        required=False,
+        max_length=settings.IMAGE_BULK_STATUS_MAX_IDS
+    )
+    since = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if not data.get("ids") and not data.get("since"):
+            raise serializers.ValidationError("Provide 'ids' or 'since'.")
+        return data
+
+
+class WebhookEndpointSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = WebhookEndpoint
+        fields = ["url", "secret", "is_active", "created_at"]
+        read_only_fields = ["secret", "created_at"]
+
+    def validate_url(self, value):
+        return validate_webhook_url(value)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    upload_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "filename",
+            "total_size",
+            "received",
+            "operations",
+            "callback_url",
+            "status",
+            "upload_url",
+            "expires_at",
+        ]
+        read_only_fields = ["id", "received", "status", "upload_url", "expires_at"]
+        extra_kwargs = {"callback_url": {"write_only": True}, "operations": {"write_only": True}}
+
+    def get_upload_url(self, obj):
+        return reverse("uploads-detail", kwargs={"pk": obj.pk}, request=self.context.get("request"))
+
+    def validate_total_size(self, value):
+        max_size = max_upload_size(self.context["request"].user)
+        if value > max_size:
+            raise serializers.ValidationError(
+                f"File size exceeds allowed limit ({max_size // (1024*1024)}MB)."
+            )
+        if value <= 0:
+            raise serializers.ValidationError("File is empty.")
+        return value
+
+    def validate_operations(self, value):
+        #fail early; finalize validates again with the file
+        ImageUploadSerializer().validate_operations(value)
+        return value
+
+    def validate_callback_url(self, value):
+        return validate_callback_url(value, self.context["request"])
+
+    def create(self, validated_data):
+        user = self.context["request"].user
+        return UploadSession.objects.create(
+            user=user if user.is_authenticated else None,
+            is_anonymous=not user.is_authenticated,
+            expires_at=timezone.now() + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS),
+            **validated_data
+        )
@@ -0,0 +1,41 @@
+"""
+Storage key layout for image files:
+
+    images/<kind>/<h1>/<h2>/<image id><ext>
+
+h1/h2 are the first hex digits of a hash of the image id, so writes spread
+evenly over many key prefixes (S3 partitions request capacity by prefix).
+Keys derive from the image's UUID, so they never collide and the storage
+can skip its existence check; reprocessing an image overwrites its output.
+"""
+import hashlib
+import os
+
+
+def shard_prefix(image_id):
+    digest = hashlib.md5(str(image_id).encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}"
+
+
+def image_key(kind, image_id, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return f"images/{kind}/{shard_prefix(image_id)}/{image_id}{ext}"
+
+
+def original_upload_to(instance, filename):
+    return image_key("originals", instance.id, filename)
+
+
+def processed_upload_to(instance, filename):
+    return image_key("processed", instance.id, filename)
+
+
+def preview_upload_to(instance, filename):
+    return image_key("previews", instance.id, filename)
+
+
+UPLOAD_KINDS = {
+    "original_image": "originals",
+    "processed_image": "processed",
+    "preview_image": "previews",
+}
@@ -1,141 +1,401 @@
-
-from io import BytesIO
+import contextvars
+import io
+import logging
+import threading
+import time
+from tempfile import SpooledTemporaryFile
 from datetime import timedelta
 from celery import shared_task
 from django.utils import timezone
-from django.db.models import Avg, F, ExpressionWrapper, DurationField
+from django.conf import settings
+from django.core.files import File
 from django.core.files.base import ContentFile
-from PIL import Image as PILImage, ImageFilter
-from .models import Image
+from django.db import connection
+from PIL import Image as PILImage
+from .models import Image, UploadSession
+from .cache import original_cache, queue_for_original
+from .processing import encode_image, make_preview
+from .uploads import discard_chunks
+from .utils import (
+    acquire_image_lease,
+    release_image_lease,
+    image_lease_held,
+    estimate_processing_time,
+    estimate_job_cost,
+)
+from .webhooks import emit_image_event, deliver_due_webhooks
+from .tracing import span, record_span, traceparent, parse_traceparent, current_span
+from . import pipeline, scheduling
+
+
+logger = logging.getLogger(__name__)
+
+
+class OutputSpool(SpooledTemporaryFile):
+    """
+    Spooled buffer for encoded output. Pillow asks for fileno() to write
+    directly, which would force an early rollover to disk, so it is only
+    exposed once the buffer has actually spilled.
+    """
+
+    def fileno(self):
+        if not self._rolled:
+            raise io.UnsupportedOperation("fileno")
+        return super().fileno()
+
+
+def enqueue_image(image):
+    """
+    Queue processing for an image, routed to the shard that caches its original.
+    The pixel count probed at upload lets workers budget memory.
+    """
+    queue = queue_for_original(image.original_image.name)
+    options = {"queue": queue} if queue else {}
+
+    #trace context of the upload request, plus the enqueue time for queue wait
+    headers = {"trace_enqueued_ns": time.time_ns()}
+    #lets a pipelined worker prefetch the original as soon as the job is reserved
+    headers["original_name"] = image.original_image.name
+    if traceparent():
+        headers["traceparent"] = traceparent()
+    if image.pixels:
+        headers["image_pixels"] = image.pixels
+    options["headers"] = headers
+
+    #held in the user's fair-scheduling list (image_pro/scheduling.py) when enabled
+    tenant, tier = scheduling.tenant_for(image)
+    operations = image.operations.values("operation_type", "parameters")
+    #every frame is processed, as charged by the upload's compute budget
+    pixels = (image.pixels or settings.IMAGE_DEFAULT_JOB_PIXELS) * image.frame_count
+    cost = estimate_job_cost(pixels, operations)
+    if scheduling.submit(dict(options, image_id=str(image.id)), tenant, tier, cost):
+        return None
+
+    return process_image_task.apply_async((image.id,), **options)
+
+
+def _task_header(request, name):
+    value = request.get(name)
+    if value is None:
+        value = (request.get("headers") or {}).get(name)
+    return value
+
+
+#acks_late: a worker crash re-queues the job instead of losing it
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_image_task(self, image_id):
+    parent = parse_traceparent(_task_header(self.request, "traceparent"))
+
+    with span("process_image_task", parent=parent, image_id=str(image_id)):
+        enqueued_ns = _task_header(self.request, "trace_enqueued_ns")
+        tenant = _task_header(self.request, "fair_tenant")
+        if enqueued_ns:
+            delivery_info = self.request.delivery_info or {}
+            record_span("queue.wait", int(enqueued_ns), time.time_ns(), queue=delivery_info.get("routing_key", ""))
+            scheduling.record_queue_wait(tenant, enqueued_ns)
+
+        try:
+            _process_image(image_id)
+        finally:
+            #a slot opened up: feed the next fair-scheduled job to the broker
+            scheduling.dispatch()
+
+
+def _process_image(image_id):
+    image_obj = None
 
+    lease = acquire_image_lease(image_id)
+    if not lease:
+        logger.info("Image %s is already being processed, skipping", image_id)
+        return
 
+    try:
+        with span("db.load_image"):
+            image_obj = Image.objects.filter(id=image_id).first()
+        if image_obj is None or image_obj.status == "completed":
+            #deleted, or a redelivery of a job that already finished
+            return
 
-@shared_task
-def process_image_task(image_id):
-    image_obj = None
+        if image_obj.processing_attempts >= settings.IMAGE_TASK_MAX_ATTEMPTS:
+            #redelivered after crashing the worker every time
+            logger.warning("Image %s failed after %s attempts", image_id, image_obj.processing_attempts)
+            fail_image(image_obj)
+            return
+
+        with span("db.mark_processing"):
+            mark_processing(image_obj, estimate_processing_time(image_obj))
+
+        with span("storage.fetch_original", key=image_obj.original_image.name):
+            img = original_cache.open(image_obj.original_image)
+
+        if settings.IMAGE_PIPELINE_MODE:
+            output = encode_output(image_obj, img)
+            store_in_background(image_obj, output, lease)
+            #released by the background store
+            lease = None
+            return
+
+        complete_image(image_obj, img)
+
+    except Exception as e:
+        if image_obj:
+            fail_image(image_obj)
+        raise e
 
+    finally:
+        if lease:
+            release_image_lease(image_id, lease)
+
+
+def mark_processing(image_obj, expected_duration):
+    now = timezone.now()
+    image_obj.status = "processing"
+    image_obj.processing_started_at = now
+    image_obj.estimated_ready_at = now + expected_duration
+    image_obj.processing_attempts += 1
+
+    image_obj.save(update_fields=[
+        "status",
+        "processing_started_at",
+        "estimated_ready_at",
+        "processing_attempts",
+        "updated_at"
+    ])
+
+
+def encode_output(image_obj, img):
+    """
+    Run the operations on the decoded original into an output spool: small
+    outputs stay in memory, large ones spill to disk. The caller closes it.
+    """
+    with span("db.load_operations"):
+        operations = [
+            (op.operation_type, op.parameters)
+            for op in image_obj.operations.all().order_by("created_at")
+        ]
+
+    output = OutputSpool(max_size=settings.IMAGE_OUTPUT_SPOOL_MAX_BYTES)
     try:
-        image_obj = Image.objects.get(id=image_id)
-        now = timezone.now()
-        image_obj.status = "processing"
-        image_obj.processing_started_at = now
-
-        recent_images = (
-            Image.objects
-            .filter(
-                status="completed",
-                processing_started_at__isnull=False,
-                processing_completed_at__isnull=False
-            )
-            .order_by("-processing_completed_at")[:10]
-            .annotate(
-                duration=ExpressionWrapper(
-                    F("processing_completed_at") - F("processing_started_at"),
-                    output_field=DurationField()
-                )
+        with span("image.encode", operations=len(operations), pixels=image_obj.pixels or 0):
+            image_obj.image_format = encode_image(img, output, operations, image_obj.image_format)
+    except Exception:
+        output.close()
+        raise
+
+    return output
+
+
+def save_output(image_obj, output):
+    """
+    Upload the encoded output (the storage streams it, multipart on S3) to
+    processed_image, without saving the row.
+    """
+    with output:
+        output_size = output.tell()
+        output.seek(0)
+
+        with span("storage.save_processed", bytes=output_size):
+            image_obj.processed_image.save(
+                f"processed_{image_obj.id}.{image_obj.image_format}",
+                File(output),
+                save=False
             )
-        )
 
-        average_duration = recent_images.aggregate(
-            avg_duration=Avg("duration")
-        )["avg_duration"]
 
-        if average_duration:
-            image_obj.estimated_ready_at = now + average_duration
-        else:
-            image_obj.estimated_ready_at = now + timedelta(seconds=8)
+def store_output(image_obj, output):
+    """
+    Upload the encoded output and mark the image completed.
+    """
+    save_output(image_obj, output)
+
+    image_obj.status = "completed"
+    image_obj.processing_completed_at = timezone.now()
+    image_obj.estimated_ready_at = None
 
+    with span("db.mark_completed"):
         image_obj.save(update_fields=[
+            "processed_image",
+            "image_format",
             "status",
-            "processing_started_at",
-            "estimated_ready_at"
+            "processing_completed_at",
+            "estimated_ready_at",
+            "updated_at"
         ])
 
-    
-        img = PILImage.open(image_obj.original_image)
-        operations = image_obj.operations.all().order_by("created_at")
-
-        quality = 85  # default quality
-
-        #operations
-        for operation in operations:
-            op_type = operation.operation_type
-            params = operation.parameters
-
-            if op_type == "resize":
-                width = params.get("width")
-                height = params.get("height")
-
-                if width and height:
-                    img = img.resize((int(width), int(height)))
-
-            elif op_type == "compress":
-                quality = params.get("quality", 85)
-
-            elif op_type == "filter":
-                filter_type = params.get("type")
-
-                if filter_type == "grayscale":
-                    img = img.convert("L")
-                elif filter_type == "blur":
-                    img = img.filter(ImageFilter.BLUR)
-                elif filter_type == "sharpen":
-                    img = img.filter(ImageFilter.SHARPEN)
-
-            elif op_type == "convert":
-                new_format = params.get("format")
-                if new_format:
-                    image_obj.image_format = new_format.lower()
-
-    
-        FORMAT_MAP = {
-            "jpg": "JPEG",
-            "jpeg": "JPEG",
-            "png": "PNG",
-            "webp": "WEBP",
-        }
-
-        format_name = FORMAT_MAP.get(
-            image_obj.image_format.lower(),
-            image_obj.image_format.upper()
-        )
+    with span("webhooks.emit"):
+        notify_image_event(image_obj, "image.completed")
+
+
+def complete_image(image_obj, img):
+    """
+    Encode, store and mark completed. Shared by the worker and the inline upload path.
+    """
+    store_output(image_obj, encode_output(image_obj, img))
+
+
+def store_in_background(image_obj, output, lease):
+    """
+    Pipelined mode: hand the upload and final writes to the I/O pool and
+    let the child take its next job. The lease is released only afterwards.
+    """
+    active = current_span()
+    parent = (active.trace_id, active.span_id) if active else None
+
+    def run():
+        try:
+            with span("pipeline.store", parent=parent, image_id=str(image_obj.id)):
+                store_output(image_obj, output)
+        except Exception as e:
+            logger.exception("Storing output of image %s failed: %s", image_obj.id, e)
+            fail_image(image_obj)
+        finally:
+            release_image_lease(image_obj.id, lease)
+            connection.close()
+
+    pipeline.submit_upload(run)
+
+
+def fail_image(image_obj):
+    image_obj.status = "failed"
+    image_obj.estimated_ready_at = None
+    image_obj.save(update_fields=["status", "estimated_ready_at", "updated_at"])
+    notify_image_event(image_obj, "image.failed")
+
+
+#inline runs going in this web process, each holding a DB connection
+_inline_slots = None
+
+
+def process_inline(image_obj, data, budget):
+    """
+    Run a cheap job inside the upload request, on its own thread so the
+    request waits at most budget seconds. data is the uploaded file's bytes,
+    so the original is not fetched back from storage. Returns True when the
+    image finished (completed or failed) within the budget, and False when
+    the run is still going: it then finishes on its own under the image
+    lease, so a worker never repeats it, and the stuck-job reaper re-queues
+    it if this process dies. Returns None, and the caller enqueues the job,
+    when the lease is taken or IMAGE_INLINE_MAX_RUNNING runs are already
+    going in this process.
+    """
+    global _inline_slots
+
+    if _inline_slots is None:
+        _inline_slots = threading.BoundedSemaphore(settings.IMAGE_INLINE_MAX_RUNNING)
+    if not _inline_slots.acquire(blocking=False):
+        return None
+
+    lease = acquire_image_lease(image_obj.id)
+    if not lease:
+        _inline_slots.release()
+        return None
+
+    mark_processing(image_obj, timedelta(seconds=budget))
+    done = threading.Event()
+
+    def run():
+        try:
+            with span("inline.process"):
+                complete_image(image_obj, PILImage.open(io.BytesIO(data)))
+        except Exception as e:
+            logger.exception("Inline processing of image %s failed: %s", image_obj.id, e)
+            fail_image(image_obj)
+        finally:
+            release_image_lease(image_obj.id, lease)
+            _inline_slots.release()
+            done.set()
+            connection.close()
+
+    #spans of the run stay in the upload request's trace
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
+
+    return done.wait(budget)
+
+
+def notify_image_event(image_obj, event):
+    """
+    Queue webhook events and schedule a delivery run shortly after, so events
+    finishing close together go out in one batch per endpoint.
+    """
+    if emit_image_event(image_obj, event):
+        deliver_webhooks.apply_async(countdown=settings.WEBHOOK_BATCH_WINDOW_SECONDS)
 
-        #save processed image
-        output = BytesIO()
 
-        img.save(
-            output,
-            format=format_name,
-            quality=quality
-        )
+@shared_task
+def deliver_webhooks():
+    delivered, failed = deliver_due_webhooks()
+    if delivered or failed:
+        logger.info("Delivered %s webhook events, %s failed", delivered, failed)
+
 
-        image_obj.processed_image.save(
-            f"processed_{image_obj.id}.{image_obj.image_format}",
-            ContentFile(output.getvalue()),
-            save=False
+@shared_task
+def dispatch_fair_queue():
+    """
+    Safety net for dispatch passes skipped while another one held the lock.
+    """
+    scheduling.dispatch()
+
+
+@shared_task
+def requeue_stuck_images():
+    """
+    Re-enqueue jobs left in processing past the deadline by a lost worker,
+    or fail them once they have used up IMAGE_TASK_MAX_ATTEMPTS.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.IMAGE_TASK_STUCK_AFTER_SECONDS)
+    stuck_images = Image.objects.filter(
+        status="processing",
+        processing_started_at__lte=cutoff
+    )
+
+    for img in stuck_images:
+        if image_lease_held(img.id):
+            continue
+
+        exhausted = img.processing_attempts >= settings.IMAGE_TASK_MAX_ATTEMPTS
+
+        #compare-and-set so concurrent reapers act only once
+        reset = Image.objects.filter(pk=img.pk, status="processing").update(
+            status="failed" if exhausted else "pending",
+            estimated_ready_at=None,
+            updated_at=timezone.now()
         )
+        if not reset:
+            continue
 
+        if exhausted:
+            logger.warning("Image %s failed after %s attempts", img.id, img.processing_attempts)
+            img.status = "failed"
+            notify_image_event(img, "image.failed")
+        else:
+            logger.info("Re-enqueueing image %s (attempt %s)", img.id, img.processing_attempts + 1)
+            enqueue_image(img)
 
-        image_obj.status = "completed"
-        image_obj.processing_completed_at = timezone.now()
-        image_obj.estimated_ready_at = None
 
-        image_obj.save(update_fields=[
-            "processed_image",
-            "status",
-            "processing_completed_at",
-            "estimated_ready_at"
-        ])
 
-    except Exception as e:
-        if image_obj:
-            image_obj.status = "failed"
-            image_obj.estimated_ready_at = None
-            image_obj.save(update_fields=["status", "estimated_ready_at"])
 
-        raise e
+#routed to the "previews" queue, which has its own worker
+@shared_task(acks_late=True)
+def generate_preview_task(image_id):
+    image_obj = Image.objects.filter(id=image_id).first()
+    if image_obj is None or image_obj.preview_image:
+        return
 
+    img = original_cache.open(image_obj.original_image)
+    preview, placeholder = make_preview(
+        img,
+        size=settings.IMAGE_PREVIEW_SIZE,
+        placeholder_size=settings.IMAGE_PLACEHOLDER_SIZE
+    )
 
+    image_obj.preview_image.save(
+        f"preview_{image_obj.id}.webp",
+        ContentFile(preview),
+        save=False
+    )
+    image_obj.preview_placeholder = placeholder
+    image_obj.save(update_fields=["preview_image", "preview_placeholder", "updated_at"])
 
 
 @shared_task
@@ -145,10 +405,10 @@ def delete_expired_images():
         download_expires_at__lte=now
     )
     count = expired_images.count()
-    print(f"[delete_expired_images] Found {count} expired images at {now}")
+    logger.info("Found %s expired images at %s", count, now)
 
     for img in expired_images:
-        print(f"[delete_expired_images] Deleting image {img.id}")
+        logger.info("Deleting expired image %s", img.id)
 
         if img.original_image:
             img.original_image.delete(save=False)
@@ -156,4 +416,21 @@ def delete_expired_images():
         if img.processed_image:
             img.processed_image.delete(save=False)
 
-        img.delete()
\ No newline at end of file
+        if img.preview_image:
+            img.preview_image.delete(save=False)
+
+        img.delete()
+
+
+@shared_task
+def delete_expired_upload_sessions():
+    """
+    Drop resumable uploads that were never finalized, with their chunks.
+    """
+    expired = UploadSession.objects.filter(expires_at__lte=timezone.now())
+
+    for session in expired.filter(status="open"):
+        logger.info("Deleting expired upload %s", session.id)
+        discard_chunks(session)
+
+    expired.delete()
@@ -1,3 +1,1058 @@
-from django.test import TestCase
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+import fakeredis
+from botocore.config import Config
+from celery.signals import task_received
+from celery.worker import state as worker_state
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from accounts.models import User
+from .admission import STATE_KEY
+from .autoscale import PROCESS_TASK_NAME, CostAwareAutoscaler
+from .models import Image, ImageOperation, WebhookDelivery
+from .processing import TruncatedImageError, apply_operations, encode_image, probe_image
+from .storage_keys import processed_upload_to
+from .throttling import ComputeCostBudget
+from .utils import image_lease_held
+from .tasks import _process_image, encode_output, enqueue_image, generate_preview_task, process_inline, requeue_stuck_images, save_output
+from .management.commands.reprocess_images import _reprocess_chunk
+from .webhooks import emit_image_event, deliver_due_webhooks, sign
+from . import pipeline, scheduling, tasks, tracing
+from config.celery import app as celery_app
+from config.storages import MediaStorage, storage_metrics
 
-# Create your tests here.
+
+def png_upload(size=(64, 48), name="in.png"):
+    data = BytesIO()
+    PILImage.new("RGB", size, "red").save(data, format="PNG")
+    return SimpleUploadedFile(name, data.getvalue(), content_type="image/png")
+
+
+class MediaRootMixin:
+    """
+    Files saved by a test go to a temporary MEDIA_ROOT.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class WebhookReceiver(BaseHTTPRequestHandler):
+    """
+    Local stand-in for a client's webhook endpoint.
+    """
+    received = []
+    response_status = 200
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.received.append((self.headers, body))
+        self.send_response(self.response_status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(WEBHOOK_DEFAULT_SECRET="test-secret", WEBHOOK_ALLOW_HTTP=True, WEBHOOK_ALLOW_PRIVATE=True)
+class WebhookDeliveryTests(TestCase):
+    def setUp(self):
+        WebhookReceiver.received = []
+        WebhookReceiver.response_status = 200
+        self.server = HTTPServer(("127.0.0.1", 0), WebhookReceiver)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/hook"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_image(self):
+        return Image.objects.create(
+            original_image="images/originals/test.png",
+            image_format="png",
+            is_anonymous=True,
+            status="completed",
+            processing_completed_at=timezone.now(),
+            callback_url=self.url,
+        )
+
+    def test_events_are_batched_and_signed(self):
+        images = [self.make_image(), self.make_image()]
+        for image in images:
+            emit_image_event(image, "image.completed")
+
+        delivered, failed = deliver_due_webhooks()
+
+        self.assertEqual((delivered, failed), (2, 0))
+        self.assertEqual(len(WebhookReceiver.received), 1)
+
+        headers, body = WebhookReceiver.received[0]
+        expected = sign("test-secret", headers["X-ImagePro-Timestamp"], body)
+        self.assertEqual(headers["X-ImagePro-Signature"], f"sha256={expected}")
+
+        events = json.loads(body)["events"]
+        self.assertEqual({e["image_id"] for e in events}, {str(i.id) for i in images})
+        self.assertFalse(WebhookDelivery.objects.exclude(status="delivered").exists())
+
+    def test_failed_delivery_is_retried_later(self):
+        WebhookReceiver.response_status = 500
+        emit_image_event(self.make_image(), "image.completed")
+
+        delivered, failed = deliver_due_webhooks()
+
+        self.assertEqual((delivered, failed), (0, 1))
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual(delivery.status, "pending")
+        self.assertEqual(delivery.attempts, 1)
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE=False)
+    def test_internal_addresses_are_never_posted_to(self):
+        for url in (self.url, "http://169.254.169.254/latest/meta-data/", "http://10.0.0.5/hook"):
+            WebhookDelivery.objects.create(url=url, secret="test-secret", payload={"event": "image.completed"})
+
+        delivered, failed = deliver_due_webhooks()
+
+        self.assertEqual((delivered, failed), (0, 3))
+        self.assertEqual(WebhookReceiver.received, [])
+        self.assertEqual(WebhookDelivery.objects.filter(status="failed").count(), 3)
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE=False, IMAGE_ADMISSION_CONTROL=False)
+    def test_internal_callback_url_is_rejected_on_upload(self):
+        response = self.client.post("/api/images/", {
+            "original_image": png_upload(),
+            "operations": "[]",
+            "callback_url": "http://169.254.169.254/latest/meta-data/",
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("callback_url", response.json())
+
+    @override_settings(WEBHOOK_DEFAULT_SECRET="", IMAGE_ADMISSION_CONTROL=False)
+    def test_callback_url_needs_a_signing_secret(self):
+        response = self.client.post("/api/images/", {
+            "original_image": png_upload(),
+            "operations": "[]",
+            "callback_url": self.url,
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("callback_url", response.json())
+
+
+class FailingExporter(tracing.SpanExporter):
+    def export(self, spans):
+        raise OSError("collector unreachable")
+
+
+class TracingTests(TestCase):
+    def setUp(self):
+        tracing._exporter = None
+
+    def tearDown(self):
+        tracing._exporter = None
+
+    def test_file_exporter_links_request_and_worker_spans(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traces.jsonl")
+
+            with override_settings(TRACE_EXPORTER="file", TRACE_FILE_PATH=path):
+                with tracing.span("POST /api/images/") as request_span:
+                    header = tracing.traceparent()
+
+                #what the worker does with the task header
+                with tracing.span("process_image_task", parent=tracing.parse_traceparent(header)):
+                    with tracing.span("image.encode"):
+                        pass
+
+            with open(path) as fh:
+                spans = {s["name"]: s for s in map(json.loads, fh)}
+
+        self.assertEqual({s["trace_id"] for s in spans.values()}, {request_span.trace_id})
+        self.assertEqual(spans["process_image_task"]["parent_id"], request_span.span_id)
+        self.assertEqual(spans["image.encode"]["parent_id"], spans["process_image_task"]["span_id"])
+
+    def test_otlp_exporter_posts_to_collector(self):
+        WebhookReceiver.received = []
+        WebhookReceiver.response_status = 200
+        server = HTTPServer(("127.0.0.1", 0), WebhookReceiver)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            endpoint = f"http://127.0.0.1:{server.server_port}/v1/traces"
+            with override_settings(TRACE_EXPORTER="otlp", TRACE_OTLP_ENDPOINT=endpoint):
+                with tracing.span("process_image_task", image_id="abc"):
+                    pass
+
+                deadline = time.monotonic() + 5
+                while not WebhookReceiver.received and time.monotonic() < deadline:
+                    time.sleep(0.01)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        _headers, body = WebhookReceiver.received[0]
+        otlp_span = json.loads(body)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        self.assertEqual(otlp_span["name"], "process_image_task")
+        self.assertEqual(otlp_span["attributes"], [{"key": "image_id", "value": {"stringValue": "abc"}}])
+
+    @override_settings(TRACE_EXPORTER="image_pro.tests.FailingExporter")
+    def test_failed_export_is_logged_not_raised(self):
+        with self.assertLogs("image_pro.tracing", "WARNING") as logs:
+            with tracing.span("process_image_task"):
+                pass
+
+        self.assertIn("collector unreachable", logs.output[0])
+
+    def test_exporters_must_implement_export(self):
+        with self.assertRaises(TypeError):
+            tracing.SpanExporter()
+
+
+@override_settings(IMAGE_PIPELINE_MODE=False)
+class ProcessImageTaskTests(MediaRootMixin, TestCase):
+    def test_process_image_runs_to_completion(self):
+        image = Image.objects.create(original_image=png_upload(), image_format="png", is_anonymous=True)
+        ImageOperation.objects.create(image=image, operation_type="resize", parameters={"width": 32, "height": 24})
+
+        with override_settings(TRACE_EXPORTER="none"):
+            tracing._exporter = None
+            _process_image(image.id)
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, "completed")
+        self.assertIsNotNone(image.processing_completed_at)
+        with image.processed_image.open() as fh:
+            self.assertEqual(PILImage.open(fh).size, (32, 24))
+
+
+    def stuck_image(self, attempts):
+        return Image.objects.create(
+            original_image="images/originals/stuck.png",
+            image_format="png",
+            is_anonymous=True,
+            status="processing",
+            processing_started_at=timezone.now() - timedelta(days=1),
+            processing_attempts=attempts,
+        )
+
+    @override_settings(IMAGE_TASK_MAX_ATTEMPTS=3)
+    def test_reaper_requeues_then_gives_up(self):
+        retry, exhausted = self.stuck_image(1), self.stuck_image(3)
+
+        with mock.patch("image_pro.tasks.enqueue_image") as enqueue:
+            requeue_stuck_images()
+
+        enqueue.assert_called_once()
+        self.assertEqual(enqueue.call_args.args[0].id, retry.id)
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual((retry.status, exhausted.status), ("pending", "failed"))
+
+    @override_settings(IMAGE_TASK_MAX_ATTEMPTS=3)
+    def test_redelivered_job_fails_once_attempts_are_used_up(self):
+        image = Image.objects.create(
+            original_image=png_upload(), image_format="png", is_anonymous=True, processing_attempts=3
+        )
+
+        _process_image(image.id)
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, "failed")
+        self.assertFalse(image.processed_image)
+
+
+@override_settings(IMAGE_PIPELINE_MODE=True, IMAGE_PIPELINE_IO_THREADS=1, IMAGE_PIPELINE_PENDING_UPLOADS=1)
+class PipelinedProcessingTests(MediaRootMixin, TransactionTestCase):
+    def test_upload_overlaps_and_keeps_the_lease(self):
+        image = Image.objects.create(original_image=png_upload(), image_format="png", is_anonymous=True)
+        release = threading.Event()
+
+        def slow_save(image_obj, output):
+            release.wait(10)
+            save_output(image_obj, output)
+
+        with mock.patch("image_pro.tasks.save_output", slow_save):
+            _process_image(image.id)
+
+            #the task returned while its upload is still pending
+            image.refresh_from_db()
+            self.assertEqual(image.status, "processing")
+            self.assertTrue(image_lease_held(image.id))
+
+            release.set()
+            pipeline.drain_uploads()
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, "completed")
+        self.assertFalse(image_lease_held(image.id))
+        self.assertTrue(image.processed_image)
+
+    def test_two_jobs_with_a_full_upload_buffer(self):
+        images = [
+            Image.objects.create(original_image=png_upload(), image_format="png", is_anonymous=True)
+            for _ in range(2)
+        ]
+        release = threading.Event()
+
+        def slow_save(image_obj, output):
+            release.wait(10)
+            save_output(image_obj, output)
+
+        with mock.patch("image_pro.tasks.save_output", slow_save), \
+                mock.patch("image_pro.pipeline.close_old_connections") as close_connections:
+            _process_image(images[0].id)
+
+            #the second job waits for the first upload to leave the buffer
+            second = threading.Thread(target=_process_image, args=(images[1].id,))
+            second.start()
+            second.join(0.5)
+            self.assertTrue(second.is_alive())
+            #having handed its connection back for the upload thread
+            close_connections.assert_called_once()
+
+            release.set()
+            second.join(10)
+            pipeline.drain_uploads()
+
+        for image in images:
+            image.refresh_from_db()
+            self.assertEqual(image.status, "completed")
+            self.assertFalse(image_lease_held(image.id))
+
+    def worker_pool_size(self, **env):
+        env = dict(
+            os.environ,
+            DATABASE_URL="postgres://imagepro@localhost/imagepro",
+            DB_POOL_MODE="pool",
+            SERVICE_TYPE="worker",
+            **env,
+        )
+        script = "from config.settings import base; print(base.DATABASES['default']['OPTIONS']['pool']['max_size'])"
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            env=env,
+            cwd=settings.BASE_DIR.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return int(result.stdout)
+
+    def test_worker_pool_has_a_connection_per_upload_thread(self):
+        self.assertEqual(self.worker_pool_size(IMAGE_PIPELINE_MODE="false"), 1)
+        self.assertEqual(self.worker_pool_size(IMAGE_PIPELINE_MODE="true", IMAGE_PIPELINE_IO_THREADS="3"), 4)
+
+
+class InlineProcessingTests(MediaRootMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        tasks._inline_slots = None
+        self.addCleanup(setattr, tasks, "_inline_slots", None)
+
+    def inline_upload(self):
+        upload = png_upload()
+        image = Image.objects.create(original_image=upload, image_format="png", is_anonymous=True)
+        upload.seek(0)
+        return image, upload.read()
+
+    def test_run_past_the_budget_finishes_without_a_worker(self):
+        image, data = self.inline_upload()
+        finish = threading.Event()
+
+        def slow_encode(image_obj, img):
+            finish.wait(10)
+            return encode_output(image_obj, img)
+
+        with mock.patch("image_pro.tasks.encode_output", slow_encode):
+            self.assertIs(process_inline(image, data, 0.05), False)
+
+            #still running under its lease, so a worker would skip it
+            image.refresh_from_db()
+            self.assertEqual((image.status, image.processing_attempts), ("processing", 1))
+            self.assertTrue(image_lease_held(image.id))
+
+            finish.set()
+            deadline = time.monotonic() + 10
+            while image_lease_held(image.id) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        image.refresh_from_db()
+        self.assertEqual(image.status, "completed")
+        self.assertTrue(image.processed_image)
+
+    @override_settings(IMAGE_INLINE_MAX_RUNNING=1)
+    def test_uploads_past_the_running_limit_are_queued(self):
+        (first, first_data), (second, second_data) = self.inline_upload(), self.inline_upload()
+        finish = threading.Event()
+
+        def slow_encode(image_obj, img):
+            finish.wait(10)
+            return encode_output(image_obj, img)
+
+        with mock.patch("image_pro.tasks.encode_output", slow_encode):
+            self.assertIs(process_inline(first, first_data, 0.05), False)
+            self.assertIsNone(process_inline(second, second_data, 0.05))
+            finish.set()
+            deadline = time.monotonic() + 10
+            while image_lease_held(first.id) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        second.refresh_from_db()
+        self.assertEqual(second.status, "pending")
+
+
+class PointwiseOperationTests(TestCase):
+    OPERATIONS = [
+        ("brightness", {"factor": 1.3}),
+        ("contrast", {"factor": 0.7}),
+        ("gamma", {"value": 2.2}),
+        ("filter", {"type": "grayscale"}),
+        ("levels", {"black": 20, "white": 230}),
+        ("threshold", {"value": 100}),
+    ]
+
+    def gradient(self):
+        img = PILImage.new("RGBA", (256, 3))
+        img.putdata([(x, 255 - x, (x * 7) % 256, x // 2) for _ in range(3) for x in range(256)])
+        return img
+
+    def test_fused_table_matches_one_operation_at_a_time(self):
+        for count in range(1, len(self.OPERATIONS) + 1):
+            operations = self.OPERATIONS[:count]
+
+            expected = self.gradient()
+            for operation in operations:
+                expected = apply_operations(expected, [operation])
+
+            fused = apply_operations(self.gradient(), operations)
+            self.assertEqual(fused.mode, expected.mode)
+            self.assertEqual(list(fused.getdata()), list(expected.getdata()), operations)
+
+
+@override_settings(IMAGE_ADMISSION_CONTROL=False)
+class ResumableUploadTests(MediaRootMixin, TestCase):
+    def noise_png(self):
+        data = BytesIO()
+        PILImage.frombytes("RGB", (96, 64), os.urandom(96 * 64 * 3)).save(data, format="PNG")
+        return data.getvalue()
+
+    def put_chunk(self, url, offset, chunk):
+        return self.client.put(
+            url, chunk, content_type="application/octet-stream", headers={"Upload-Offset": str(offset)}
+        )
+
+    @mock.patch("image_pro.tasks.enqueue_image")
+    @mock.patch("image_pro.tasks.generate_preview_task")
+    def test_resumed_upload_assembles_the_same_bytes(self, preview_task, enqueue):
+        content = self.noise_png()
+        third = len(content) // 3
+
+        response = self.client.post("/api/uploads/", {
+            "filename": "noise.png",
+            "total_size": len(content),
+            "operations": json.dumps([{"operation_type": "resize", "parameters": {"width": 48, "height": 32}}]),
+        })
+        self.assertEqual(response.status_code, 201)
+        url = f"/api/uploads/{response.json()['id']}/"
+
+        self.assertEqual(self.put_chunk(url, 0, content[:third]).status_code, 200)
+
+        #the client lost the response and resends the first chunk
+        retry = self.put_chunk(url, 0, content[:third])
+        self.assertEqual(retry.status_code, 409)
+        self.assertEqual(retry["Upload-Offset"], str(third))
+
+        #and resumes from where the server says it is
+        offset = int(self.client.head(url)["Upload-Offset"])
+        self.assertEqual(offset, third)
+        self.assertEqual(self.put_chunk(url, offset, content[offset:2 * third]).status_code, 200)
+        self.assertEqual(self.put_chunk(url, 2 * third, content[2 * third:]).status_code, 200)
+
+        response = self.client.post(f"{url}finalize/")
+        self.assertEqual(response.status_code, 201)
+
+        image = Image.objects.get()
+        with image.original_image.open() as fh:
+            self.assertEqual(fh.read(), content)
+        enqueue.assert_called_once()
+
+
+class ImageListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="lister", password="secret-pass-123")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def test_pages_have_no_duplicates_or_gaps(self):
+        images = [
+            Image.objects.create(user=self.user, original_image=f"images/originals/{i}.png", image_format="png")
+            for i in range(23)
+        ]
+        #runs of equal created_at, so the id tie-break is exercised across page edges
+        base = timezone.now() - timedelta(hours=1)
+        for i, image in enumerate(images):
+            Image.objects.filter(pk=image.pk).update(created_at=base + timedelta(seconds=i // 4))
+        expected = [
+            str(pk) for pk in Image.objects.order_by("-created_at", "-id").values_list("id", flat=True)
+        ]
+
+        seen = []
+        url = "/api/images/?page_size=5"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), 5)
+            seen.extend(row["id"] for row in page["results"])
+            url = page["next"]
+
+        self.assertEqual(seen, expected)
+
+
+class BulkStatusTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="poller", password="secret-pass-123")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def test_unchanged_poll_is_not_modified(self):
+        images = [
+            Image.objects.create(user=self.user, original_image=f"images/originals/{i}.png", image_format="png")
+            for i in range(3)
+        ]
+        url = "/api/images/status/?ids=" + ",".join(str(image.pk) for image in images)
+
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(first.json()["results"]), 3)
+
+        again = self.client.get(url, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+
+        images[1].status = "processing"
+        images[1].save(update_fields=["status", "updated_at"])
+
+        changed = self.client.get(url, headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+
+
+@override_settings(
+    IMAGE_ADMISSION_CONTROL=True,
+    IMAGE_ADMISSION_LIMITS={
+        "user": {"max_backlog": 50, "max_drain_seconds": 600},
+        "anon": {"max_backlog": 10, "max_drain_seconds": 600},
+    },
+    IMAGE_ADMISSION_MIN_DRAIN_RATE=1,
+)
+class AdmissionTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def upload_with_backlog(self, backlog):
+        with mock.patch("image_pro.scheduling.held_jobs", return_value=backlog), \
+                mock.patch("image_pro.scheduling.process_queues", return_value=[]):
+            return self.client.post("/api/images/", {"original_image": png_upload(), "operations": "[]"})
+
+    def test_upload_over_the_backlog_limit_is_shed(self):
+        response = self.upload_with_backlog(40)
+
+        self.assertEqual(response.status_code, 503)
+        #the 30 jobs over the limit, drained at one per second
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertFalse(Image.objects.exists())
+
+    @mock.patch("image_pro.tasks.enqueue_image")
+    @mock.patch("image_pro.tasks.generate_preview_task")
+    def test_upload_under_the_backlog_limit_is_admitted(self, preview_task, enqueue):
+        response = self.upload_with_backlog(10)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("Retry-After", response)
+
+    @mock.patch("image_pro.tasks.enqueue_image")
+    @mock.patch("image_pro.tasks.generate_preview_task")
+    def test_finalize_over_the_backlog_limit_is_shed(self, preview_task, enqueue):
+        content = png_upload().read()
+        with mock.patch("image_pro.scheduling.held_jobs", return_value=0), \
+                mock.patch("image_pro.scheduling.process_queues", return_value=[]):
+            response = self.client.post("/api/uploads/", {
+                "filename": "upload.png", "total_size": len(content), "operations": "[]",
+            })
+        self.assertEqual(response.status_code, 201)
+        url = f"/api/uploads/{response.json()['id']}/"
+        self.client.put(url, content, content_type="application/octet-stream", headers={"Upload-Offset": "0"})
+        #the backlog grows while the chunks are sent
+        cache.delete(STATE_KEY)
+
+        with mock.patch("image_pro.scheduling.held_jobs", return_value=40), \
+                mock.patch("image_pro.scheduling.process_queues", return_value=[]):
+            response = self.client.post(f"{url}finalize/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(self.client.head(url)["Upload-Offset"], str(len(content)))
+
+        #and finalizes once the backlog has drained
+        cache.delete(STATE_KEY)
+        with mock.patch("image_pro.scheduling.held_jobs", return_value=0), \
+                mock.patch("image_pro.scheduling.process_queues", return_value=[]):
+            self.assertEqual(self.client.post(f"{url}finalize/").status_code, 201)
+        enqueue.assert_called_once()
+
+
+class FakeRequest:
+    name = PROCESS_TASK_NAME
+
+    def __init__(self, pixels):
+        self.request_dict = {"image_pixels": pixels}
+
+
+#1 MP costs 8 MB in estimate_job_memory
+@override_settings(IMAGE_WORKER_MEMORY_BUDGET_BYTES=40_000_000)
+class CostAwareAutoscalerTests(TestCase):
+    def qty(self, active, reserved):
+        for req in reserved:
+            task_received.send(sender=None, request=req)
+
+        with mock.patch.object(worker_state, "active_requests", set(active)), \
+                mock.patch.object(worker_state, "reserved_requests", set(active) | set(reserved)):
+            return CostAwareAutoscaler(mock.Mock(), 8).qty
+
+    def test_budget_follows_the_order_jobs_start_in(self):
+        small = [FakeRequest(1_000_000) for _ in range(3)]
+
+        #a huge job at the head waits for its own process; the small ones
+        #behind it can't start before it
+        self.assertEqual(self.qty([small[0]], [FakeRequest(10_000_000), small[1], small[2]]), 1)
+        self.assertEqual(self.qty([small[0]], [small[1], small[2], FakeRequest(10_000_000)]), 3)
+
+    def test_one_job_always_runs(self):
+        self.assertEqual(self.qty([], [FakeRequest(10_000_000)]), 1)
+
+
+@override_settings(
+    IMAGE_FAIR_SCHEDULING=True,
+    IMAGE_FAIR_QUANTUM=1,
+    IMAGE_FAIR_WEIGHTS={"anon": 1, "user": 1, "pro": 2},
+    IMAGE_FAIR_DISPATCH_DEPTH=6,
+)
+class FairSchedulingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.redis = fakeredis.FakeStrictRedis()
+        self.apply_async = mock.Mock()
+        for target, value in (
+            ("image_pro.scheduling._redis", mock.Mock(return_value=self.redis)),
+            ("image_pro.scheduling.broker_queue_depth", mock.Mock(return_value=0)),
+            ("image_pro.scheduling.process_queues", mock.Mock(return_value=["celery"])),
+            ("image_pro.tasks.process_image_task.apply_async", self.apply_async),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def hold(self, tenant, count, cost=1, tier="user"):
+        #without the dispatch pass submit() runs after each job
+        with mock.patch.object(scheduling, "dispatch"):
+            for i in range(count):
+                scheduling.submit({"image_id": f"{tenant}-{i}"}, tenant, tier, cost)
+
+    def sent(self):
+        return [call.args[0][0] for call in self.apply_async.call_args_list]
+
+    def test_tenants_take_turns(self):
+        self.hold("a", 6)
+        self.hold("b", 2)
+
+        self.assertEqual(scheduling.dispatch(), 6)
+        self.assertEqual(self.sent(), ["a-0", "b-0", "a-1", "b-1", "a-2", "a-3"])
+        self.assertEqual(scheduling.held_jobs(), 2)
+
+    def test_weight_scales_the_quantum(self):
+        self.hold("a", 6, tier="pro")
+        self.hold("b", 6)
+
+        scheduling.dispatch()
+
+        self.assertEqual(self.sent(), ["a-0", "a-1", "b-0", "a-2", "a-3", "b-1"])
+
+    def test_expensive_job_saves_up_deficit_without_starving(self):
+        self.hold("big", 1, cost=2.5)
+        self.hold("small", 5)
+
+        with override_settings(IMAGE_FAIR_DISPATCH_DEPTH=4):
+            scheduling.dispatch()
+        #three visits of quantum 1 before 2.5 fits; the small jobs keep flowing
+        self.assertEqual(self.sent(), ["small-0", "small-1", "big-0", "small-2"])
+
+        scheduling.dispatch()
+        self.assertEqual(self.sent()[4:], ["small-3", "small-4"])
+        self.assertEqual(scheduling.held_jobs(), 0)
+        self.assertEqual(self.redis.hgetall(scheduling.DEFICIT_KEY), {})
+
+    def test_job_is_kept_when_the_broker_is_unreachable(self):
+        self.hold("a", 2)
+        self.apply_async.side_effect = OSError("broker down")
+
+        with self.assertLogs("image_pro.scheduling", "WARNING"):
+            self.assertEqual(scheduling.dispatch(), 0)
+        self.assertEqual(scheduling.held_jobs(), 2)
+        #the cost of the unsent job went back to the tenant
+        self.assertEqual(float(self.redis.hget(scheduling.DEFICIT_KEY, "a")), 1)
+
+        self.apply_async.side_effect = None
+        self.apply_async.reset_mock()
+        self.assertEqual(scheduling.dispatch(), 2)
+        self.assertEqual(self.sent(), ["a-0", "a-1"])
+
+    def test_seen_tenants_are_trimmed(self):
+        self.redis.zadd(scheduling.SEEN_KEY, {"gone": time.time() - scheduling.SEEN_RETENTION_SECONDS - 60})
+
+        scheduling.record_queue_wait("a", time.time_ns())
+
+        self.assertEqual(self.redis.zrange(scheduling.SEEN_KEY, 0, -1), [b"a"])
+
+    def test_animated_jobs_are_charged_per_frame(self):
+        costs = []
+        for frames in (1, 10):
+            image = Image.objects.create(
+                original_image="images/originals/anim.gif", image_format="gif", is_anonymous=True,
+                width=1000, height=1000, frame_count=frames,
+            )
+            with mock.patch("image_pro.scheduling.submit", return_value=True) as submit:
+                enqueue_image(image)
+            costs.append(submit.call_args.args[3])
+
+        self.assertEqual(costs, [1.0, 10.0])
+
+
+@override_settings(
+    IMAGE_ADMISSION_CONTROL=False,
+    IMAGE_COST_BUDGETS={
+        "user": {"capacity": 100, "refill_per_min": 60},
+        "anon": {"capacity": 10, "refill_per_min": 60},
+    },
+)
+class ComputeCostBudgetTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeStrictRedis()
+        patcher = mock.patch.object(ComputeCostBudget, "_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def budget(self):
+        request = RequestFactory().post("/api/images/")
+        request.user = AnonymousUser()
+        return ComputeCostBudget(request)
+
+    def test_rejects_past_the_budget_and_refills_over_time(self):
+        self.assertEqual(self.budget().charge(8)[:2], (True, 2.0))
+
+        allowed, remaining, wait = self.budget().charge(5)
+        self.assertFalse(allowed)
+        #3 units short at one unit per second
+        self.assertEqual(wait, 3)
+
+        key = "cost-budget:anon:127.0.0.1"
+        self.redis.hset(key, "ts", float(self.redis.hget(key, "ts")) - wait)
+        allowed, remaining, _ = self.budget().charge(5)
+        self.assertTrue(allowed)
+        self.assertAlmostEqual(remaining, 0, delta=0.1)
+
+    def test_job_larger_than_the_bucket_still_runs(self):
+        self.assertEqual(self.budget().charge(50)[:2], (True, 0.0))
+
+    @mock.patch("image_pro.tasks.enqueue_image")
+    @mock.patch("image_pro.tasks.generate_preview_task")
+    def test_cost_scales_with_pixels_and_frames(self, preview_task, enqueue):
+        frames = [PILImage.new("RGB", (500, 400), (50 * i, 0, 0)) for i in range(5)]
+        gif = BytesIO()
+        frames[0].save(gif, format="GIF", save_all=True, append_images=frames[1:], duration=100)
+        operations = json.dumps([{"operation_type": "resize", "parameters": {"width": 250, "height": 200}}])
+
+        remaining = []
+        for upload in (png_upload((500, 400)), SimpleUploadedFile("in.gif", gif.getvalue(), content_type="image/gif")):
+            response = self.client.post("/api/images/", {"original_image": upload, "operations": operations})
+            self.assertEqual(response.status_code, 201)
+            remaining.append(float(response["X-Cost-Budget-Remaining"]))
+
+        #0.2 MP x (1 + resize) = 0.4 per frame
+        self.assertAlmostEqual(10 - remaining[0], 0.4, delta=0.05)
+        self.assertAlmostEqual(remaining[0] - remaining[1], 5 * 0.4, delta=0.05)
+
+
+@override_settings(IMAGE_ADMISSION_CONTROL=False)
+class PreviewTests(MediaRootMixin, TestCase):
+    @mock.patch("image_pro.tasks.enqueue_image")
+    @mock.patch("image_pro.tasks.generate_preview_task.delay")
+    def test_preview_is_served_before_processing_finishes(self, preview_delay, enqueue):
+        response = self.client.post("/api/images/", {"original_image": png_upload((1200, 900)), "operations": "[]"})
+        self.assertEqual(response.status_code, 201)
+        image = Image.objects.get()
+        preview_delay.assert_called_once_with(image.id)
+
+        #what the previews worker does while the job is still queued
+        generate_preview_task(image.id)
+
+        detail = self.client.get(f"/api/images/{image.id}/").json()
+        self.assertEqual(detail["status"], "pending")
+        self.assertTrue(detail["preview_url"])
+        self.assertTrue(detail["preview_placeholder"].startswith("data:image/webp;base64,"))
+
+        image.refresh_from_db()
+        with image.preview_image.open() as fh:
+            preview = PILImage.open(fh)
+            self.assertEqual((preview.format, preview.size), ("WEBP", (256, 192)))
+
+    def test_previews_have_their_own_queue(self):
+        route = celery_app.amqp.router.route({}, "image_pro.tasks.generate_preview_task")
+        self.assertEqual(route["queue"].name, "previews")
+        route = celery_app.amqp.router.route({}, "image_pro.tasks.process_image_task")
+        self.assertNotEqual(route["queue"].name, "previews")
+
+
+class ProbeImageTests(TestCase):
+    def encoded(self, format_name):
+        img = PILImage.frombytes("RGB", (64, 48), random.Random(0).randbytes(64 * 48 * 3))
+        data = BytesIO()
+        img.save(data, format=format_name)
+        return data.getvalue()
+
+    def test_complete_files_pass(self):
+        for format_name in ("JPEG", "PNG", "GIF"):
+            with self.subTest(format=format_name):
+                self.assertEqual(probe_image(BytesIO(self.encoded(format_name)))["format"], format_name)
+
+    def test_truncated_files_are_rejected(self):
+        for format_name in ("JPEG", "PNG", "GIF"):
+            with self.subTest(format=format_name):
+                data = self.encoded(format_name)
+                with self.assertRaises(TruncatedImageError):
+                    probe_image(BytesIO(data[:len(data) * 2 // 3]))
+
+    def test_gif_needs_the_trailer_as_its_last_byte(self):
+        data = self.encoded("GIF")
+        #cut a few bytes after a 0x3b inside the image data, which used to pass
+        truncated = data[:data.index(b"\x3b", len(data) // 2) + 5]
+
+        with self.assertRaises(TruncatedImageError):
+            probe_image(BytesIO(truncated))
+        #NUL padding after the trailer is fine
+        self.assertEqual(probe_image(BytesIO(data + b"\x00" * 4))["format"], "GIF")
+
+
+class ReprocessImagesTests(MediaRootMixin, TestCase):
+    def test_reprocess_keeps_completion_bookkeeping(self):
+        started = timezone.now() - timedelta(days=30)
+        completed = started + timedelta(seconds=4)
+        image = Image.objects.create(
+            original_image=png_upload(),
+            image_format="png",
+            is_anonymous=True,
+            status="completed",
+            processing_started_at=started,
+            processing_completed_at=completed,
+        )
+        ImageOperation.objects.create(image=image, operation_type="resize", parameters={"width": 16, "height": 12})
+
+        counts = _reprocess_chunk([image.id])
+
+        self.assertEqual(counts, {"done": 1, "skipped": 0, "failed": []})
+        image.refresh_from_db()
+        self.assertEqual((image.processing_started_at, image.processing_completed_at), (started, completed))
+        with image.processed_image.open() as fh:
+            self.assertEqual(PILImage.open(fh).size, (16, 12))
+
+    def test_command_reprocesses_and_records_failures(self):
+        good = Image.objects.create(
+            original_image=png_upload(), image_format="png", is_anonymous=True, status="completed"
+        )
+        ImageOperation.objects.create(image=good, operation_type="resize", parameters={"width": 16, "height": 12})
+        missing = Image.objects.create(
+            original_image="images/originals/missing.png", image_format="png", is_anonymous=True, status="completed"
+        )
+        checkpoint = os.path.join(self.media_root, "reprocess.json")
+        out = StringIO()
+
+        call_command("reprocess_images", workers=1, checkpoint=checkpoint, stdout=out)
+
+        self.assertIn("Reprocessed 1 images, skipped 0, 1 failed", out.getvalue())
+        with open(checkpoint) as fh:
+            state = json.load(fh)
+        self.assertEqual((state["done"], state["failed"]), (1, [str(missing.id)]))
+        #written by the pool process
+        with open(os.path.join(self.media_root, processed_upload_to(good, "out.png")), "rb") as fh:
+            self.assertEqual(PILImage.open(fh).size, (16, 12))
+
+
+class ReplayImageJobTests(MediaRootMixin, TestCase):
+    def test_image_replay_writes_nothing_back(self):
+        image = Image.objects.create(
+            original_image=png_upload(), image_format="png", is_anonymous=True, status="completed"
+        )
+        ImageOperation.objects.create(image=image, operation_type="resize", parameters={"width": 16, "height": 12})
+        saved = os.path.join(self.media_root, "replayed.png")
+        out = StringIO()
+
+        call_command("replay_image_job", image=[str(image.id)], save_output=saved, stdout=out)
+
+        self.assertIn(f"{image.id} (", out.getvalue())
+        self.assertNotIn("ERROR", out.getvalue())
+        with open(saved, "rb") as fh:
+            self.assertEqual(PILImage.open(fh).size, (16, 12))
+        image.refresh_from_db()
+        self.assertEqual(image.status, "completed")
+        self.assertFalse(image.processed_image)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, "images", "processed")))
+
+    def test_file_replay_with_operations(self):
+        path = os.path.join(self.media_root, "input.png")
+        PILImage.new("RGB", (64, 48), "red").save(path)
+        out = StringIO()
+
+        call_command(
+            "replay_image_job",
+            file=path,
+            operations=json.dumps([{"operation_type": "resize", "parameters": {"width": 8, "height": 6}}]),
+            stdout=out,
+        )
+
+        self.assertIn(f"{path}: fetch_original=", out.getvalue())
+        self.assertIn("output=", out.getvalue())
+        self.assertNotIn("ERROR", out.getvalue())
+
+
+class MigrateStorageKeysTests(MediaRootMixin, TestCase):
+    def test_row_follows_a_renamed_copy(self):
+        image = Image.objects.create(original_image=png_upload(), image_format="png", is_anonymous=True)
+        with image.original_image.open() as fh:
+            content = fh.read()
+        new_name = image.original_image.name
+        old_name = default_storage.save("legacy/photo.png", ContentFile(content))
+        Image.objects.filter(id=image.id).update(original_image=old_name)
+        #left at the new key by an earlier, interrupted run
+        default_storage.delete(new_name)
+        default_storage.save(new_name, ContentFile(b"stale"))
+
+        call_command("migrate_storage_keys", stdout=StringIO())
+
+        image.refresh_from_db()
+        self.assertNotEqual(image.original_image.name, new_name)
+        self.assertTrue(image.original_image.name.startswith(os.path.dirname(new_name)))
+        with image.original_image.open() as fh:
+            self.assertEqual(fh.read(), content)
+        self.assertFalse(default_storage.exists(old_name))
+
+
+class AnimationTests(TestCase):
+    DURATIONS = [50, 60, 70, 80, 90]
+
+    def animation(self, format_name):
+        frames = [PILImage.new("RGB", (32, 32), (40 * i, 0, 255 - 40 * i)) for i in range(len(self.DURATIONS))]
+        data = BytesIO()
+        frames[0].save(data, format=format_name, save_all=True, append_images=frames[1:], duration=self.DURATIONS, loop=0)
+        data.seek(0)
+        return PILImage.open(data)
+
+    def durations(self, img):
+        durations = []
+        for index in range(img.n_frames):
+            img.seek(index)
+            img.load()
+            durations.append(img.info["duration"])
+        return durations
+
+    def test_frame_durations_round_trip(self):
+        for format_name, image_format in (("GIF", "gif"), ("WEBP", "webp")):
+            with self.subTest(format=format_name):
+                output = BytesIO()
+                encode_image(self.animation(format_name), output, [("resize", {"width": 16, "height": 16})], image_format)
+
+                output.seek(0)
+                result = PILImage.open(output)
+                self.assertEqual(result.n_frames, len(self.DURATIONS))
+                self.assertEqual(self.durations(result), self.DURATIONS)
+
+    def test_webp_without_the_streaming_encoder(self):
+        output = BytesIO()
+        with mock.patch("image_pro.animation._webp_encoder", return_value=None):
+            encode_image(self.animation("WEBP"), output, [("resize", {"width": 16, "height": 16})], "webp")
+
+        output.seek(0)
+        result = PILImage.open(output)
+        self.assertEqual((result.size, result.n_frames), ((16, 16), len(self.DURATIONS)))
+        self.assertEqual(self.durations(result), self.DURATIONS)
+
+
+class PooledS3StorageTests(TestCase):
+    def make_storage(self):
+        return MediaStorage(
+            access_key="test",
+            secret_key="test",
+            bucket_name="bucket",
+            region_name="us-east-1",
+            endpoint_url="http://127.0.0.1:9",
+            client_config=self.config,
+        )
+
+    def setUp(self):
+        self.config = Config(retries={"mode": "standard", "max_attempts": 1}, connect_timeout=1)
+
+    def test_threads_share_the_client_but_not_resources(self):
+        storage = self.make_storage()
+        seen = []
+
+        def use():
+            seen.append((storage.connection, storage.bucket))
+
+        threads = [threading.Thread(target=use) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len({id(resource) for resource, _ in seen}), 3)
+        self.assertEqual(len({id(bucket.meta.client) for _, bucket in seen}), 1)
+        self.assertIs(self.make_storage().connection.meta.client, seen[0][0].meta.client)
+
+    def test_failed_calls_are_counted(self):
+        before = storage_metrics().get("HeadObject", {"calls": 0, "errors": 0})
+        with self.assertRaises(Exception):
+            self.make_storage().exists("missing")
+
+        after = storage_metrics()["HeadObject"]
+        self.assertEqual(after["calls"] - before["calls"], 1)
+        self.assertEqual(after["errors"] - before["errors"], 1)
@@ -0,0 +1,81 @@
+import math
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+
+#refill, charge and expiry in one atomic round trip
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class ComputeCostBudget:
+    """
+    Redis token bucket charged by estimated job cost instead of request count.
+    Disabled (always allows) when the default cache is not Redis, as in dev.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.scope = "user" if request.user.is_authenticated else "anon"
+        config = settings.IMAGE_COST_BUDGETS[self.scope]
+        self.capacity = config["capacity"]
+        self.rate = config["refill_per_min"] / 60
+
+    def get_ident(self):
+        if self.request.user.is_authenticated:
+            return str(self.request.user.pk)
+        return BaseThrottle().get_ident(self.request)
+
+    def _redis(self):
+        try:
+            from django_redis import get_redis_connection
+        except ImportError:
+            return None
+
+        if not hasattr(cache, "client"):
+            return None
+        return get_redis_connection("default")
+
+    def charge(self, cost):
+        """
+        Returns (allowed, remaining, wait seconds). A job larger than the
+        whole bucket is charged the full capacity so it can still run.
+        """
+        redis = self._redis()
+        if redis is None:
+            return True, None, None
+
+        cost = min(cost, self.capacity)
+        key = f"cost-budget:{self.scope}:{self.get_ident()}"
+        allowed, remaining = redis.eval(
+            TOKEN_BUCKET_SCRIPT, 1, key, self.capacity, self.rate, cost
+        )
+        remaining = float(remaining)
+
+        wait = None
+        if not allowed:
+            wait = math.ceil((cost - remaining) / self.rate)
+
+        self.request.cost_budget = {"limit": self.capacity, "remaining": remaining}
+        return bool(allowed), remaining, wait
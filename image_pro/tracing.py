@@ -0,0 +1,275 @@
+"""
+Minimal distributed tracing for the upload -> queue -> worker path.
+
+Spans are timed with span(); the active span lives in a contextvar so
+nested calls become children. Context crosses into Celery as a W3C
+traceparent task header. When the outermost span in a process ends, the
+finished spans of that process are handed to the configured exporter
+(TRACE_EXPORTER): "none", "file" (JSON lines, for local use), "otlp"
+(OTLP/HTTP JSON to a collector) or a dotted path to a SpanExporter.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes, local_root=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        #spans finished in this process are exported together with their local root
+        self.local_root = local_root or self
+        self.finished = [] if local_root is None else None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+            "service": settings.TRACE_SERVICE_NAME,
+        }
+
+
+def parse_traceparent(value):
+    """
+    (trace_id, parent_span_id) from a W3C traceparent header, or None.
+    """
+    try:
+        version, trace_id, span_id, _flags = value.split("-")
+        int(trace_id, 16), int(span_id, 16)
+    except (AttributeError, ValueError):
+        return None
+
+    if len(trace_id) != 32 or len(span_id) != 16 or version != "00":
+        return None
+    return trace_id, span_id
+
+
+def current_span():
+    return _current.get()
+
+
+def current_trace_id():
+    span_obj = _current.get()
+    return span_obj.trace_id if span_obj else ""
+
+
+def traceparent():
+    span_obj = _current.get()
+    if span_obj is None:
+        return None
+    return f"00-{span_obj.trace_id}-{span_obj.span_id}-01"
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Time a block as a child of the active span, or of parent (a remote
+    context from parse_traceparent), or as the root of a new trace.
+    """
+    active = _current.get()
+    if active is not None:
+        span_obj = Span(name, active.trace_id, active.span_id, attributes, active.local_root)
+    elif parent is not None:
+        span_obj = Span(name, parent[0], parent[1], attributes)
+    else:
+        span_obj = Span(name, secrets.token_hex(16), None, attributes)
+
+    token = _current.set(span_obj)
+    try:
+        yield span_obj
+    except Exception as e:
+        span_obj.error = repr(e)
+        raise
+    finally:
+        span_obj.end_ns = time.time_ns()
+        _current.reset(token)
+        _finish(span_obj)
+
+
+def record_span(name, start_ns, end_ns, **attributes):
+    """
+    Add an already-measured interval (e.g. time spent queued) under the active span.
+    """
+    active = _current.get()
+    if active is None:
+        return
+
+    span_obj = Span(name, active.trace_id, active.span_id, attributes, active.local_root)
+    span_obj.start_ns = start_ns
+    span_obj.end_ns = end_ns
+    _finish(span_obj)
+
+
+def _finish(span_obj):
+    root = span_obj.local_root
+    root.finished.append(span_obj)
+
+    if span_obj is root:
+        try:
+            get_exporter().export([s.as_dict() for s in root.finished])
+        except Exception:
+            #tracing must never fail the request or job
+            logger.warning("Span export failed", exc_info=True)
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, spans):
+        """
+        Take a list of finished spans (Span.as_dict()) of one local trace.
+        """
+
+
+class NullExporter(SpanExporter):
+    def export(self, spans):
+        pass
+
+
+class FileExporter(SpanExporter):
+    """
+    One JSON span per line, appended with a single write so web and worker
+    processes can share the file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.TRACE_FILE_PATH
+        self.lock = threading.Lock()
+
+    def export(self, spans):
+        data = "".join(json.dumps(s, default=str) + "\n" for s in spans).encode()
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+
+class OTLPHttpExporter(SpanExporter):
+    """
+    OTLP/HTTP with JSON encoding, accepted by the OpenTelemetry collector
+    and most tracing backends on /v1/traces. Spans are posted from a
+    background thread so a slow collector never delays requests or jobs;
+    if it falls behind, new spans are dropped.
+    """
+
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint or settings.TRACE_OTLP_ENDPOINT
+        self.queue = None
+        self.pid = None
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def payload(self, spans):
+        otlp_spans = []
+        for s in spans:
+            otlp_span = {
+                "traceId": s["trace_id"],
+                "spanId": s["span_id"],
+                "name": s["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(s["start_ns"]),
+                "endTimeUnixNano": str(s["end_ns"]),
+                "attributes": [self._attribute(k, v) for k, v in s["attributes"].items()],
+                "status": {"code": 2, "message": s["error"]} if s["error"] else {"code": 1},
+            }
+            if s["parent_id"]:
+                otlp_span["parentSpanId"] = s["parent_id"]
+            otlp_spans.append(otlp_span)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", settings.TRACE_SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "image_pro"}, "spans": otlp_spans}],
+            }]
+        }
+
+    def export(self, spans):
+        #the sender thread does not survive a fork
+        if self.pid != os.getpid():
+            self.queue = queue.Queue(maxsize=1000)
+            self.pid = os.getpid()
+            threading.Thread(target=self._send_loop, args=(self.queue,), daemon=True).start()
+
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            pass
+
+    def _send_loop(self, pending):
+        from .webhooks import get_session
+
+        while True:
+            spans = pending.get()
+            #whatever else is waiting goes in the same request
+            while len(spans) < 500 and not pending.empty():
+                spans = spans + pending.get_nowait()
+
+            try:
+                response = get_session().post(
+                    self.endpoint,
+                    json=self.payload(spans),
+                    timeout=settings.TRACE_EXPORT_TIMEOUT,
+                )
+                response.raise_for_status()
+            except Exception:
+                logger.warning("OTLP export to %s failed", self.endpoint, exc_info=True)
+
+
+EXPORTERS = {
+    "none": NullExporter,
+    "file": FileExporter,
+    "otlp": OTLPHttpExporter,
+}
+
+_exporter = None
+
+
+def get_exporter():
+    global _exporter
+
+    if _exporter is None:
+        name = settings.TRACE_EXPORTER
+        exporter_class = EXPORTERS[name] if name in EXPORTERS else import_string(name)
+        _exporter = exporter_class()
+
+    return _exporter
@@ -0,0 +1,43 @@
+import mimetypes
+import shutil
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+
+COPY_BUFFER = 1024 * 1024
+
+
+def chunk_name(session, offset):
+    return f"uploads/{session.id}/{offset:012d}"
+
+
+def store_chunk(session, offset, data):
+    """
+    Save one chunk to the default storage (local media or S3) as it arrives.
+    """
+    return default_storage.save(chunk_name(session, offset), ContentFile(data))
+
+
+def assemble(session):
+    """
+    Concatenate the stored chunks into a temporary file on disk, copying a
+    buffer at a time, so the original is never held in memory. The result
+    behaves like a regular multipart upload for ImageUploadSerializer.
+    """
+    content_type = mimetypes.guess_type(session.filename)[0] or "application/octet-stream"
+    upload = TemporaryUploadedFile(session.filename, content_type, session.total_size, None)
+
+    for name in session.chunks:
+        with default_storage.open(name) as chunk:
+            shutil.copyfileobj(chunk, upload, COPY_BUFFER)
+
+    upload.flush()
+    upload.seek(0)
+    return upload
+
+
+def discard_chunks(session):
+    for name in session.chunks:
+        default_storage.delete(name)
@@ -1,7 +1,13 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import ImageViewSet
+from .views import ImageViewSet, UploadSessionViewSet, WebhookEndpointView, AdmissionStatusView, StorageStatsView
 
 router = DefaultRouter()
 router.register("images", ImageViewSet, basename="images")
+router.register("uploads", UploadSessionViewSet, basename="uploads")
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = [
+    path("webhook/", WebhookEndpointView.as_view(), name="webhook"),
+    path("admission/", AdmissionStatusView.as_view(), name="admission"),
+    path("storage-stats/", StorageStatsView.as_view(), name="storage-stats"),
+] + router.urls
\ No newline at end of file
@@ -1,5 +1,13 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from datetime import timedelta
+from .models import Image
+
+
+def _lease_key(image_id):
+    return f"image-lease:{image_id}"
 
 def mark_download_expiry(image):
     """
@@ -9,4 +17,100 @@ def mark_download_expiry(image):
         image.download_expires_at = timezone.now() + timedelta(seconds=20)
     else:
         image.download_expires_at = timezone.now() + timedelta(minutes=5)
-    image.save(update_fields=["download_expires_at"])
\ No newline at end of file
+    image.save(update_fields=["download_expires_at"])
+
+
+def acquire_image_lease(image_id):
+    """
+    Take the per-image processing lease. Returns a token, or None when another
+    run holds it. The lease expires on its own if the holder dies.
+    """
+    token = uuid.uuid4().hex
+    if cache.add(_lease_key(image_id), token, timeout=settings.IMAGE_TASK_LEASE_SECONDS):
+        return token
+    return None
+
+
+def release_image_lease(image_id, token):
+    """
+    Release the lease, unless it already expired and was taken by another run.
+    """
+    if cache.get(_lease_key(image_id)) == token:
+        cache.delete(_lease_key(image_id))
+
+
+def image_lease_held(image_id):
+    return cache.get(_lease_key(image_id)) is not None
+
+
+def estimate_job_memory(pixels):
+    """
+    Rough peak memory of a job: decoded source plus one transformed copy, RGBA.
+    """
+    return pixels * 4 * 2
+
+
+#relative compute cost per megapixel; decode + encode counts as 1
+OPERATION_COST_WEIGHTS = {
+    "resize": 1.0,
+    "convert": 0.5,
+    "compress": 0.5,
+    #pointwise operations are fused into one lookup table pass
+    "brightness": 0.1,
+    "contrast": 0.1,
+    "gamma": 0.1,
+    "levels": 0.1,
+    "threshold": 0.1,
+    "filter": {
+        "grayscale": 0.5,
+        "blur": 3.0,
+        "sharpen": 2.0,
+    },
+}
+
+
+def estimate_job_cost(pixels, operations):
+    """
+    Cost units of a job: megapixels x (1 + sum of operation weights).
+    """
+    weight = 1.0
+    for op in operations:
+        op_weight = OPERATION_COST_WEIGHTS.get(op["operation_type"], 1.0)
+        if isinstance(op_weight, dict):
+            op_weight = op_weight.get(op["parameters"].get("type"), 1.0)
+        weight += op_weight
+
+    return pixels / 1_000_000 * weight
+
+
+def estimate_processing_time(image):
+    """
+    Expected duration of a job from the last 10 completed ones, scaled by
+    the probed pixel count when both sides have it.
+    """
+    recent = list(
+        Image.objects
+        .filter(
+            status="completed",
+            processing_started_at__isnull=False,
+            processing_completed_at__isnull=False
+        )
+        .order_by("-processing_completed_at")
+        .values_list("processing_started_at", "processing_completed_at", "width", "height", "frame_count")[:10]
+    )
+
+    if not recent:
+        return timedelta(seconds=8)
+
+    durations = [(completed - started).total_seconds() for started, completed, *_ in recent]
+
+    sized = [
+        (seconds, width * height * frame_count)
+        for seconds, (_, _, width, height, frame_count) in zip(durations, recent)
+        if width and height
+    ]
+    if image.pixels and sized:
+        seconds_per_pixel = sum(s for s, _ in sized) / sum(p for _, p in sized)
+        return timedelta(seconds=max(seconds_per_pixel * image.pixels * image.frame_count, 1))
+
+    return timedelta(seconds=sum(durations) / len(durations))
@@ -1,13 +1,29 @@
-import boto3
-from rest_framework import viewsets, status, permissions
+import hashlib
+from rest_framework import viewsets, generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.views import APIView
+from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.db import transaction
 from django.http import FileResponse
-from .models import Image
-from .serializers import ImageUploadSerializer, ImageDetailSerializer
+from .models import Image, WebhookEndpoint, UploadSession
+from .serializers import (
+    ImageUploadSerializer,
+    ImageDetailSerializer,
+    ImageListSerializer,
+    ImageListQuerySerializer,
+    BulkStatusQuerySerializer,
+    WebhookEndpointSerializer,
+    UploadSessionSerializer,
+)
+from .uploads import store_chunk, assemble, discard_chunks
+from .pagination import KeysetPagination
+from .tracing import span
+from .admission import check_admission, backlog_state, admission_counts
 from .utils import mark_download_expiry
 
 
@@ -15,22 +31,74 @@ class ImageViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
     queryset = Image.objects.all()
     http_method_names = ["get", "post"]
+    pagination_class = KeysetPagination
 
     def get_serializer_class(self):
         if self.action == "create":
             return ImageUploadSerializer
+        if self.action == "list":
+            return ImageListSerializer
         return ImageDetailSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        #opt-in synchronous processing of small uploads
+        context["inline"] = self.request.query_params.get("sync", "").lower() in ("1", "true")
+        return context
+
+    def get_throttles(self):
+        #uploads are charged by compute cost in ImageUploadSerializer instead
+        if self.action == "create":
+            return []
+        return super().get_throttles()
+
+    def create(self, request, *args, **kwargs):
+        #root of the job's trace; enqueue_image carries it into the worker
+        with span("POST /api/images/", authenticated=request.user.is_authenticated) as trace:
+            #before the upload is parsed, probed or stored
+            check_admission(request)
+            response = super().create(request, *args, **kwargs)
+            trace.set(status_code=response.status_code)
+
+        response["X-Trace-Id"] = trace.trace_id
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        budget = getattr(request, "cost_budget", None)
+        if budget:
+            response["X-Cost-Budget-Limit"] = str(budget["limit"])
+            response["X-Cost-Budget-Remaining"] = f"{budget['remaining']:.2f}"
+
+        return response
     
     
 
     def get_queryset(self):
         user = self.request.user
 
-        if user.is_authenticated:
-            return Image.objects.filter(user=user)
+        if not user.is_authenticated:
+            #none for anonymous users
+            return Image.objects.none()
 
-        #none for anonymous users
-        return Image.objects.none()
+        queryset = Image.objects.filter(user=user)
+        if self.action != "list":
+            return queryset
+
+        #status and created_at ranges stay on the (user[, status], created_at, id) indexes
+        filters = ImageListQuerySerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+
+        if "status" in params:
+            queryset = queryset.filter(status=params["status"])
+        if "created_after" in params:
+            queryset = queryset.filter(created_at__gte=params["created_after"])
+        if "created_before" in params:
+            queryset = queryset.filter(created_at__lt=params["created_before"])
+
+        return queryset.values(*ImageListSerializer.LIST_FIELDS)
     
 
     def get_object(self):
@@ -43,7 +111,8 @@ class ImageViewSet(viewsets.ModelViewSet):
         obj = get_object_or_404(queryset, pk=self.kwargs["pk"])
         
         if self.request.user.is_authenticated:
-            if obj.user != self.request.user:
+            #compare ids: obj.user would load the owner row again
+            if obj.user_id != self.request.user.pk:
                 raise PermissionDenied("Unauthorized")
         else:
             if not obj.is_anonymous:
@@ -53,6 +122,71 @@ class ImageViewSet(viewsets.ModelViewSet):
     
     
     
+    #columns ImageDetailSerializer reads, plus what the ETag and access checks need
+    STATUS_FIELDS = [
+        "id",
+        "status",
+        "estimated_ready_at",
+        "preview_image",
+        "preview_placeholder",
+        "trace_id",
+        "created_at",
+        "updated_at",
+    ]
+
+    @action(detail=False, methods=["get", "post"], url_path="status")
+    def bulk_status(self, request):
+        """
+        Status of many images in one request, by ids (up to
+        IMAGE_BULK_STATUS_MAX_IDS) and/or changed since a timestamp.
+        Unchanged polls get 304 via If-None-Match without serializing anything.
+        """
+        if request.method == "GET":
+            params = {}
+            if request.query_params.get("ids"):
+                params["ids"] = request.query_params["ids"].split(",")
+            if request.query_params.get("since"):
+                params["since"] = request.query_params["since"]
+        else:
+            params = request.data
+
+        query = BulkStatusQuerySerializer(data=params)
+        query.is_valid(raise_exception=True)
+        ids = query.validated_data.get("ids")
+        since = query.validated_data.get("since")
+        server_time = timezone.now()
+
+        if request.user.is_authenticated:
+            images = Image.objects.filter(user=request.user)
+        elif ids:
+            images = Image.objects.filter(is_anonymous=True)
+        else:
+            raise PermissionDenied("Anonymous users must pass image ids.")
+
+        if ids:
+            images = images.filter(pk__in=ids)
+        if since:
+            images = images.filter(updated_at__gt=since)
+
+        images = list(images.only(*self.STATUS_FIELDS).order_by("updated_at"))
+
+        etag = hashlib.sha1(
+            "|".join(f"{img.pk}:{img.updated_at.timestamp()}" for img in images).encode()
+        ).hexdigest()
+        etag = f'"{etag}"'
+
+        if request.headers.get("If-None-Match") == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            serializer = ImageDetailSerializer(images, many=True, context={"request": request})
+            response = Response({
+                "results": serializer.data,
+                "server_time": server_time,
+            })
+
+        response["ETag"] = etag
+        return response
+
     @action(detail=True, methods=["get"])
     def download(self, request, pk=None):
         """
@@ -81,6 +215,188 @@ class ImageViewSet(viewsets.ModelViewSet):
         response['Content-Disposition'] = f'attachment; filename="{image.processed_image.name.split("/")[-1]}"'
 
         return response
-        
 
-    
\ No newline at end of file
+
+class WebhookEndpointView(generics.RetrieveUpdateDestroyAPIView):
+    """
+    The authenticated user's webhook settings. PUT creates or replaces them;
+    the signing secret is generated on creation.
+    """
+    serializer_class = WebhookEndpointSerializer
+
+    def get_object(self):
+        return get_object_or_404(WebhookEndpoint, user=self.request.user)
+
+    def update(self, request, *args, **kwargs):
+        instance = WebhookEndpoint.objects.filter(user=request.user).first()
+        serializer = self.get_serializer(instance, data=request.data, partial=kwargs.get("partial", False))
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(
+            serializer.data,
+            status=status.HTTP_200_OK if instance else status.HTTP_201_CREATED
+        )
+
+
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    """
+    Resumable uploads. POST creates a session; each PUT stores the chunk at
+    the Upload-Offset header, which must equal the bytes received so far;
+    GET/HEAD report progress, so a client can resume after a dropped
+    connection; POST finalize/ validates the assembled file like a direct
+    upload and queues processing.
+    """
+    permission_classes = [permissions.AllowAny]
+    serializer_class = UploadSessionSerializer
+    queryset = UploadSession.objects.all()
+    http_method_names = ["get", "head", "post", "put"]
+
+    def get_throttles(self):
+        #chunks are bounded by the session size; finalize is charged by compute cost
+        if self.action in ("update", "finalize"):
+            return []
+        return super().get_throttles()
+
+    def get_object(self):
+        """
+        Same rules as images: users see their own sessions, anonymous
+        clients only anonymous ones.
+        """
+        obj = get_object_or_404(UploadSession, pk=self.kwargs["pk"])
+
+        if self.request.user.is_authenticated:
+            if obj.user_id != self.request.user.pk:
+                raise PermissionDenied("Unauthorized")
+        elif not obj.is_anonymous:
+            raise PermissionDenied("Unauthorized")
+
+        if obj.status == "open" and obj.expires_at < timezone.now():
+            raise NotFound("Upload session expired.")
+
+        return obj
+
+    def progress_response(self, session, status_code=status.HTTP_200_OK):
+        response = Response(self.get_serializer(session).data, status=status_code)
+        response["Upload-Offset"] = str(session.received)
+        response["Upload-Length"] = str(session.total_size)
+        return response
+
+    def create(self, request):
+        check_admission(request)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = serializer.save()
+        return self.progress_response(session, status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return self.progress_response(self.get_object())
+
+    def update(self, request, pk=None):
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            raise ValidationError({"Upload-Offset": "Header with the byte offset of this chunk is required."})
+
+        #read at most one chunk; never the whole file
+        data = request.stream.read(settings.UPLOAD_CHUNK_MAX_BYTES + 1) if request.stream else b""
+        if not data:
+            raise ValidationError("Empty chunk.")
+        if len(data) > settings.UPLOAD_CHUNK_MAX_BYTES:
+            raise ValidationError(f"Chunks are limited to {settings.UPLOAD_CHUNK_MAX_BYTES} bytes.")
+
+        self.get_object()
+        with transaction.atomic():
+            #row lock: concurrent PUTs for one session are applied one at a time
+            session = UploadSession.objects.select_for_update().get(pk=pk)
+
+            if session.status != "open":
+                return Response({"error": "Upload already finalized"}, status=status.HTTP_409_CONFLICT)
+            if offset != session.received:
+                response = Response(
+                    {"error": "Offset does not match received bytes", "received": session.received},
+                    status=status.HTTP_409_CONFLICT
+                )
+                response["Upload-Offset"] = str(session.received)
+                return response
+            if offset + len(data) > session.total_size:
+                raise ValidationError("Chunk exceeds the declared upload size.")
+
+            session.chunks.append(store_chunk(session, offset, data))
+            session.received += len(data)
+            session.save(update_fields=["chunks", "received", "updated_at"])
+
+        return self.progress_response(session)
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+
+        if session.status == "completed":
+            return self.finalized_response(session)
+        if session.received != session.total_size:
+            return self.progress_response(session, status.HTTP_409_CONFLICT)
+        #the image is created here, so the backlog may have grown since create;
+        #the session stays open for a retry after Retry-After
+        check_admission(request)
+
+        #one finalize at a time per session; the image must be committed
+        #before its task is queued, so this is not a transaction
+        lease_key = f"upload-finalize:{session.pk}"
+        if not cache.add(lease_key, 1, timeout=300):
+            return Response({"error": "Upload is being finalized"}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            session.refresh_from_db()
+            if session.status == "completed":
+                return self.finalized_response(session)
+
+            upload = assemble(session)
+            try:
+                serializer = ImageUploadSerializer(
+                    data={
+                        "original_image": upload,
+                        "operations": session.operations,
+                        "callback_url": session.callback_url,
+                    },
+                    context={"request": request}
+                )
+                serializer.is_valid(raise_exception=True)
+                image = serializer.save()
+            finally:
+                upload.close()
+
+            session.status = "completed"
+            session.image = image
+            session.save(update_fields=["status", "image", "updated_at"])
+        finally:
+            cache.delete(lease_key)
+
+        discard_chunks(session)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def finalized_response(self, session):
+        #retried finalize after a lost response
+        if session.image is None:
+            return Response({"error": "Upload already finalized"}, status=status.HTTP_409_CONFLICT)
+        return Response(ImageUploadSerializer(session.image, context={"request": self.request}).data)
+
+
+class AdmissionStatusView(APIView):
+    """
+    Upload admission state and admitted/shed counts, for operators.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({**backlog_state(), "counts": admission_counts()})
+
+
+class StorageStatsView(APIView):
+    """
+    S3 call counts, errors and latency of the web process answering.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        from config.storages import storage_metrics
+        return Response(storage_metrics())
@@ -0,0 +1,212 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import WebhookDelivery
+
+
+_session = None
+_session_pid = None
+
+
+def get_session():
+    """
+    Pooled HTTP client, created once per process (after fork for workers).
+    """
+    global _session, _session_pid
+
+    if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=settings.WEBHOOK_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session, _session_pid = session, os.getpid()
+
+    return _session
+
+
+class UnsafeWebhookURL(ValueError):
+    """
+    The URL points at this network (loopback, private, link-local, ...).
+    """
+
+
+def check_webhook_url(url):
+    """
+    Resolve the URL's host and refuse any address that is not globally
+    routable, so webhooks can't be aimed at internal services or the cloud
+    metadata endpoint. Runs again at delivery time, since DNS can change
+    after the URL was accepted. WEBHOOK_ALLOW_PRIVATE turns it off (dev).
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise UnsafeWebhookURL("Webhook URLs must be absolute http(s) URLs.")
+
+    if settings.WEBHOOK_ALLOW_PRIVATE:
+        return
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise requests.ConnectionError(f"Cannot resolve {parts.hostname}")
+
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise UnsafeWebhookURL(f"{parts.hostname} resolves to a non-public address.")
+
+
+def sign(secret, timestamp, body):
+    message = f"{timestamp}.".encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def image_event_payload(image, event):
+    return {
+        "event": event,
+        "image_id": str(image.id),
+        "status": image.status,
+        "image_format": image.image_format,
+        "completed_at": image.processing_completed_at.isoformat() if image.processing_completed_at else None,
+        "created_at": timezone.now().isoformat(),
+    }
+
+
+def emit_image_event(image, event):
+    """
+    Queue an image.completed / image.failed event for the image's callback_url
+    and the owner's webhook endpoint. Returns the number of deliveries queued.
+    """
+    targets = {}
+
+    endpoint = None
+    if image.user_id:
+        endpoint = getattr(image.user, "webhook", None)
+    if endpoint and endpoint.is_active:
+        targets[endpoint.url] = endpoint.secret
+
+    secret = endpoint.secret if endpoint else settings.WEBHOOK_DEFAULT_SECRET
+    #payloads are always signed; see validate_callback_url
+    if image.callback_url and image.callback_url not in targets and secret:
+        targets[image.callback_url] = secret
+
+    if not targets:
+        return 0
+
+    payload = image_event_payload(image, event)
+    WebhookDelivery.objects.bulk_create([
+        WebhookDelivery(url=url, secret=secret, payload=payload)
+        for url, secret in targets.items()
+    ])
+    return len(targets)
+
+
+def _claim_batch():
+    """
+    Lock the next due batch (one endpoint, up to WEBHOOK_BATCH_SIZE events)
+    by pushing its next attempt past the time one POST can take, so
+    concurrent delivery runs don't send the same events twice. Batches are
+    claimed one at a time, right before they are sent.
+    """
+    now = timezone.now()
+    due = WebhookDelivery.objects.select_for_update(skip_locked=True).filter(
+        status="pending", next_attempt_at__lte=now
+    )
+
+    with transaction.atomic():
+        head = due.order_by("created_at").first()
+        if head is None:
+            return []
+
+        batch = list(
+            due.filter(url=head.url, secret=head.secret)
+            .order_by("created_at")[:settings.WEBHOOK_BATCH_SIZE]
+        )
+        #connect and read timeouts are each WEBHOOK_TIMEOUT
+        WebhookDelivery.objects.filter(pk__in=[d.pk for d in batch]).update(
+            next_attempt_at=now + timedelta(seconds=settings.WEBHOOK_TIMEOUT * 2 + 5)
+        )
+
+    return batch
+
+
+def _post_batch(url, secret, deliveries):
+    body = json.dumps({"events": [d.payload for d in deliveries]}).encode()
+    timestamp = str(int(time.time()))
+    headers = {
+        "Content-Type": "application/json",
+        "X-ImagePro-Timestamp": timestamp,
+    }
+    if secret:
+        headers["X-ImagePro-Signature"] = f"sha256={sign(secret, timestamp, body)}"
+
+    check_webhook_url(url)
+    #a redirect could point anywhere, including past check_webhook_url
+    response = get_session().post(
+        url, data=body, headers=headers, timeout=settings.WEBHOOK_TIMEOUT, allow_redirects=False
+    )
+    if response.is_redirect:
+        raise requests.HTTPError(f"Redirected to {response.headers.get('Location')}", response=response)
+    response.raise_for_status()
+
+
+def _retry_delay(attempts):
+    return min(settings.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.WEBHOOK_RETRY_MAX_SECONDS)
+
+
+def deliver_due_webhooks():
+    """
+    Send due events, one request per endpoint batch, up to
+    WEBHOOK_CLAIM_LIMIT events per run. Failed batches are retried with
+    exponential backoff until WEBHOOK_MAX_ATTEMPTS; unsafe URLs fail at once.
+    """
+    delivered = failed = 0
+
+    while delivered + failed < settings.WEBHOOK_CLAIM_LIMIT:
+        batch = _claim_batch()
+        if not batch:
+            break
+
+        ids = [d.pk for d in batch]
+        rows = WebhookDelivery.objects.filter(pk__in=ids)
+
+        try:
+            _post_batch(batch[0].url, batch[0].secret, batch)
+        except UnsafeWebhookURL as e:
+            failed += len(batch)
+            rows.update(status="failed", attempts=F("attempts") + 1, last_error=str(e))
+            continue
+        except requests.RequestException as e:
+            failed += len(batch)
+            rows.update(
+                attempts=F("attempts") + 1,
+                last_error=str(e)[:1000],
+                next_attempt_at=timezone.now() + timedelta(
+                    seconds=_retry_delay(max(d.attempts for d in batch) + 1)
+                ),
+            )
+            rows.filter(attempts__gte=settings.WEBHOOK_MAX_ATTEMPTS).update(status="failed")
+            continue
+
+        delivered += len(batch)
+        rows.update(
+            status="delivered",
+            attempts=F("attempts") + 1,
+            delivered_at=timezone.now(),
+        )
+
+    return delivered, failed